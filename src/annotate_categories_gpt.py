@@ -2,14 +2,15 @@
 # coding: utf-8
 
 import argparse
+import ast
 import gc
 import os
-import pickle
 
 import pandas as pd
 import yaml
 from tqdm import tqdm
 
+from checkpoint_handlers import CheckpointJournal
 from mongodb_lib import *
 from openai_handlers import query_gpt_with_history
 
@@ -38,9 +39,19 @@ def main():
     apikey = args.apikey
 
     object_name = f"product_textual_english_summarized_categories"
-    existing_file = fs.find_one({"filename": object_name})
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_textual_english_summarized"],
+        params={"model_name": model_name},
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "checkpoint_handlers.py"),
+            os.path.join(os.path.dirname(__file__), "openai_handlers.py"),
+            "Categories.xlsx",
+        ],
+    )
 
-    if not existing_file or args.overwrite:
+    if args.overwrite or not is_up_to_date(fs, [object_name], inputs_hash):
 
         # Import taxonomy
         taxonomy = pd.read_excel("Categories.xlsx")
@@ -59,12 +70,20 @@ def main():
         data = pd.DataFrame(data)
         data.fillna("", inplace=True)
 
+        # Resume from the annotations journaled by an interrupted run.
+        journal = CheckpointJournal(
+            "tmp/product_textual_english_summarized_categories_journal.jsonl",
+            version=inputs_hash,
+        )
+        final_d = journal.load()
+
         input_texts = [
             x + ": " + y
             for x, y in zip(
                 data["PRODUCTCODE"].tolist(),
                 data["pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED"].tolist(),
             )
+            if x not in final_d
         ]
 
         conversation_history = [
@@ -94,38 +113,26 @@ def main():
             for i in range(0, len(input_texts), batch_size)
         ]
 
-        tmp_dir = "tmp"
-
-        for batch_idx, batch in enumerate(tqdm(batches)):
+        for batch in tqdm(batches):
 
             result = query_gpt_with_history(
                 apikey, str(batch), model_name, conversation_history
             )
 
-            r = result.choices[0].message.content
-
-            with open(f"{tmp_dir}/batch_{batch_idx}_categories_gpt4o.pkl", "wb") as f:
-                pickle.dump(r, f)
+            annotations = result.choices[0].message.content
+            s = annotations.find("{")
+            e = annotations.rfind("}")
+            annotations = annotations[s : e + 1]
+            annotations = annotations.replace("Valentine's Day", "Valentines Day")
+            annotations_dict = ast.literal_eval(annotations)
 
-        final_d = {}
-
-        for file_name in os.listdir(tmp_dir):
-
-            file_path = os.path.join(tmp_dir, file_name)
-
-            with open(file_path, "rb") as f:
-                annotations = pickle.load(f)
-                s = annotations.find("{")
-                e = annotations.rfind("}")
-                annotations = annotations[s : e + 1]
-                annotations = annotations.replace("Valentine's Day", "Valentines Day")
-                annotations_dict = ast.literal_eval(annotations)
-                final_d.update(annotations_dict)
+            journal.append(annotations_dict)
+            final_d.update(annotations_dict)
 
         l = []
 
         for pc in tqdm(data["PRODUCTCODE"].tolist()):
-            if pc in list(final_d.keys()):
+            if pc in final_d:
                 l.append(final_d[pc])
             else:
                 l.append([])
@@ -133,7 +140,13 @@ def main():
         data["categories_gpt4o"] = l
 
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=data, object_name=object_name)
+        save_object(
+            fs=fs, object=data, object_name=object_name, inputs_hash=inputs_hash
+        )
+        journal.remove()
+
+    else:
+        print("Skipping category annotation.")
 
 
 if __name__ == "__main__":
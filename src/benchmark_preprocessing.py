@@ -0,0 +1,298 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import ast
+import gc
+import random
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import yaml
+
+from mongodb_lib import table_to_dataframe
+from preprocessing_handlers import DataFrameProcessor
+
+# Load configuration from YAML files.
+config = yaml.load(open("config.yaml"), Loader=yaml.FullLoader)
+bigquery_config = config["bigquery-to-retrieve"]
+key_field = bigquery_config["key-field"]
+location_field = bigquery_config["location-field"]
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+# Fields joined into text by preprocess_text_fields, compared regardless of order.
+text_fields = [
+    "pdt_inclexcl_ENG_CONTENT",
+    "pdt_product_detail_PRODUCTDESCRIPTION",
+    "pdt_product_detail_PRODUCTTITLE",
+]
+
+
+def make_product_tables(num_products, max_values=3, seed=0):
+    """
+    Generate a synthetic table shaped like product_tables, with one row per product and
+    one list of distinct values per column.
+
+    Lists may be missing (product absent from a source table), empty, or contain None.
+
+    Parameters:
+    num_products (int): The number of products.
+    max_values (int): The maximum number of values per list.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    pd.DataFrame: The synthetic product tables.
+    """
+    rng = random.Random(seed)
+    cities = ["Paris", "Rome", "Lisbon", "New York City", None]
+    dates = [pd.Timestamp(f"{year}-01-01", tz="UTC") for year in range(2019, 2025)]
+
+    def values(pool, max_count=max_values):
+        draw = rng.random()
+        if draw < 0.05:
+            return np.nan
+        if draw < 0.08:
+            return []
+        return list(
+            dict.fromkeys(rng.choice(pool) for _ in range(rng.randint(1, max_count)))
+        )
+
+    rows = []
+    for i in range(num_products):
+        rows.append(
+            {
+                key_field: f"P{i:06d}",
+                "pdt_inclexcl_ENG_CONTENT": values(
+                    [f"Inclusion {j}" for j in range(20)] + [None]
+                ),
+                "pdt_inclexcl_ENG_VIDESTINATIONCITY": values(cities, 2),
+                "pdt_product_detail_VIDESTINATIONCITY": values(cities, 2),
+                "pdt_product_detail_PRODUCTDESCRIPTION": values(
+                    [f"Description {i} {j}" for j in range(3)], 2
+                ),
+                "pdt_product_detail_PRODUCTTITLE": values([f"Title {i}"], 1),
+                "pdt_product_detail_TOURGRADEDESCRIPTION": values(
+                    [f"Tour grade {j}" for j in range(10)]
+                ),
+                "pdt_product_detail_TOURGRADECODE": values(
+                    [f"TG{j}" for j in range(10)]
+                ),
+                "pdt_product_level_VIDESTINATIONCITY": values(cities, 2),
+                "pdt_product_level_ISPRIVATETOUR": values([True, False], 1),
+                "pdt_product_level_SUPPLIERCODE": values(
+                    [f"S{j}" for j in range(50)], 2
+                ),
+                "bookings_MOSTRECENTORDERDATE": values(dates, 1),
+            }
+        )
+
+    return pd.DataFrame(rows)
+
+
+class FixtureDataFrameProcessor(DataFrameProcessor):
+    def __init__(self, product_tables, reshape="normalized", engine="pandas"):
+        """
+        Initialize the FixtureDataFrameProcessor, which reads an in-memory Arrow table,
+        as saved to MongoDB, instead of MongoDB.
+
+        Parameters:
+        product_tables (pa.Table): The product tables to preprocess.
+        reshape (str): The reshape of DataFrameProcessor, "normalized" or "explode".
+        engine (str): The engine of DataFrameProcessor, "pandas" or "polars".
+        """
+        super().__init__(
+            data_path=None,
+            key_field=key_field,
+            location_field=location_field,
+            fs=None,
+            reshape=reshape,
+            engine=engine,
+        )
+        self.product_tables = product_tables
+
+    def read_data(self):
+        """
+        Read the in-memory product tables into a DataFrame.
+        """
+        self.df = table_to_dataframe(self.product_tables)
+        self.df_text = None
+
+    def read_table(self):
+        """
+        Read the in-memory product tables.
+        """
+        self.table = self.product_tables
+        self.df = None
+        self.df_text = None
+
+
+class LegacyDataFrameProcessor(FixtureDataFrameProcessor):
+    """
+    The row-wise city fallback and unique-value reductions, kept as the reference
+    the vectorized steps are checked against.
+    """
+
+    def merge_and_remove_empty_cities(self):
+        def fill_city(row):
+            if pd.isna(row[self.location_field]):
+                if not pd.isna(row["pdt_product_level_VIDESTINATIONCITY"]):
+                    return row["pdt_product_level_VIDESTINATIONCITY"]
+                elif not pd.isna(row["pdt_inclexcl_ENG_VIDESTINATIONCITY"]):
+                    return row["pdt_inclexcl_ENG_VIDESTINATIONCITY"]
+                else:
+                    return np.nan
+            else:
+                return row[self.location_field]
+
+        self.df[self.location_field] = self.df.apply(fill_city, axis=1)
+
+        del self.df["pdt_product_level_VIDESTINATIONCITY"]
+        del self.df["pdt_inclexcl_ENG_VIDESTINATIONCITY"]
+
+        self.df = self.df.dropna(subset=[self.location_field])
+
+    def preprocess_tabular_fields(self):
+        columns_to_aggregate = [col for col in self.df.columns if col != self.key_field]
+
+        def get_unique_value(lst):
+            unique_values = pd.unique(pd.Series(lst, dtype=object))
+            unique_values = [x for x in unique_values if pd.notna(x)]
+            if len(unique_values) == 1:
+                return unique_values[0]
+            elif len(unique_values) == 0:
+                return np.nan
+            else:
+                return "; ".join(unique_values)
+
+        for col in columns_to_aggregate:
+            self.df[col] = self.df[col].apply(lambda x: get_unique_value(x))
+
+    def preprocess_text_fields(self):
+        for col in text_fields:
+            self.df_text[col] = [
+                ". ".join(list(set([str(el) for el in x]))) for x in self.df_text[col]
+            ]
+        self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"] = [
+            list(set([str(el) for el in x]))
+            for x in self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"]
+        ]
+
+
+def canonical_text(df_text):
+    """
+    Sort the joined values of the text fields, which the legacy steps join in set order.
+
+    Parameters:
+    df_text (pd.DataFrame): The preprocessed text DataFrame.
+
+    Returns:
+    pd.DataFrame: The text DataFrame with sorted values in every text field.
+    """
+    df_text = df_text.copy()
+    for col in text_fields:
+        df_text[col] = [". ".join(sorted(x.split(". "))) for x in df_text[col]]
+    df_text["pdt_product_detail_TOURGRADEDESCRIPTION"] = [
+        str(sorted(ast.literal_eval(x)))
+        for x in df_text["pdt_product_detail_TOURGRADEDESCRIPTION"]
+    ]
+    return df_text
+
+
+def run(processor_class, product_tables, reshape, engine, repeats):
+    """
+    Preprocess the product tables and time it.
+
+    Parameters:
+    processor_class (type): The processor class.
+    product_tables (pa.Table): The product tables to preprocess.
+    reshape (str): The reshape of the processor.
+    engine (str): The engine of the processor.
+    repeats (int): The number of timed runs.
+
+    Returns:
+    tuple: The processed tabular and text DataFrames, and the best time in seconds.
+    """
+    timings = []
+    for _ in range(repeats):
+        processor = processor_class(product_tables, reshape=reshape, engine=engine)
+        start = time.perf_counter()
+        processor.preprocess()
+        timings.append(time.perf_counter() - start)
+
+    return processor.df, processor.df_text, min(timings)
+
+
+def main():
+    """
+    Benchmark the preprocessing of a synthetic product_tables fixture.
+
+    Steps:
+    1. Generate the synthetic product tables.
+    2. Preprocess them with the legacy row-wise steps and with the vectorized ones,
+       both after exploding and after the column-by-column reshape, and with the
+       Polars engine.
+    3. Check that all variants produce the same DataFrames, and that both engines
+       produce identical text.
+    4. Print the timings and speedups.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num_products", type=int, default=2000, help="Number of synthetic products."
+    )
+    parser.add_argument(
+        "--max_values", type=int, default=3, help="Maximum number of values per list."
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Fixture random seed.")
+    parser.add_argument(
+        "--repeats", type=int, default=3, help="Timed runs per variant."
+    )
+
+    args = parser.parse_args()
+
+    # Round trip through Arrow, like the product tables saved to MongoDB.
+    product_tables = pa.Table.from_pandas(
+        make_product_tables(
+            args.num_products, max_values=args.max_values, seed=args.seed
+        ),
+        preserve_index=False,
+    )
+
+    variants = {
+        "legacy, explode": (LegacyDataFrameProcessor, "explode", "pandas"),
+        "vectorized, explode": (FixtureDataFrameProcessor, "explode", "pandas"),
+        "vectorized, normalized": (FixtureDataFrameProcessor, "normalized", "pandas"),
+        "polars": (FixtureDataFrameProcessor, "normalized", "polars"),
+    }
+    results = {
+        name: run(processor_class, product_tables, reshape, engine, args.repeats)
+        for name, (processor_class, reshape, engine) in variants.items()
+    }
+
+    reference_df, reference_df_text, reference_time = results["legacy, explode"]
+    for name, (df, df_text, seconds) in results.items():
+        pd.testing.assert_frame_equal(
+            df.reset_index(drop=True), reference_df.reset_index(drop=True)
+        )
+        pd.testing.assert_frame_equal(
+            canonical_text(df_text).reset_index(drop=True),
+            canonical_text(reference_df_text).reset_index(drop=True),
+        )
+        print(
+            f"{name:<24} {seconds:8.3f}s  {reference_time / seconds:6.1f}x  "
+            f"({len(df)} products)"
+        )
+
+    # Both engines join the text values in order of first appearance.
+    pd.testing.assert_frame_equal(
+        results["polars"][1], results["vectorized, normalized"][1]
+    )
+
+    print("All variants produce the same product tabular and textual data.")
+
+
+if __name__ == "__main__":
+    main()
@@ -72,12 +72,17 @@ class BigQueryDataProcessor:
         Aggregate and deduplicate values in each column of the DataFrame based on the key field.
 
         This method groups the DataFrame by the key field and aggregates the other columns,
-        removing duplicate values in each list.
+        removing duplicate values in each list. Rows are sorted first, since BigQuery
+        returns them in no particular order, so that the lists, and thus the content
+        hash of the saved table, are the same for the same data.
 
         Returns:
         None
         """
         columns_to_aggregate = [col for col in self.df.columns if col != self.key_field]
+        self.df = self.df.sort_values(
+            [self.key_field] + columns_to_aggregate, kind="stable", na_position="last"
+        )
         agg_dict = {col: list for col in columns_to_aggregate}
         self.df = self.df.groupby(self.key_field).agg(agg_dict).reset_index()
 
@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import hashlib
+import json
+
+from pymongo import ReplaceOne
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+class ResultCache:
+    def __init__(self, db, collection_name, batch_size=5000):
+        """
+        Initialize the ResultCache, a MongoDB collection holding one model output per
+        input text, keyed by the hash of the text together with the model and its parameters.
+
+        Parameters:
+        db (Database): The MongoDB database object.
+        collection_name (str): The name of the collection storing the outputs.
+        batch_size (int): The number of documents read or written per round trip.
+        """
+        self.collection = db[collection_name]
+        self.batch_size = batch_size
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text, model_name, params=None):
+        """
+        Hash a text with the model and parameters that produce its output.
+
+        Parameters:
+        text (str): The input text.
+        model_name (str): Name of the model.
+        params (dict): Parameters that affect the output, e.g. generation settings.
+
+        Returns:
+        str: The SHA-256 hex digest of the text, model and parameters.
+        """
+        payload = json.dumps(
+            {"text": str(text), "model": model_name, "params": params or {}},
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def lookup(self, keys):
+        """
+        Retrieve the cached outputs of the given keys and count hits and misses.
+
+        Parameters:
+        keys (list): Cache keys, as returned by key.
+
+        Returns:
+        dict: Key to cached output, for cache hits only.
+        """
+        keys = list(dict.fromkeys(keys))
+        cached = {}
+
+        for start in range(0, len(keys), self.batch_size):
+            cursor = self.collection.find(
+                {"_id": {"$in": keys[start : start + self.batch_size]}},
+                {"output": 1},
+            )
+            for document in cursor:
+                cached[document["_id"]] = document["output"]
+
+        self.hits += len(cached)
+        self.misses += len(keys) - len(cached)
+
+        return cached
+
+    def update(self, outputs):
+        """
+        Insert or replace the cached outputs of the given keys.
+
+        Parameters:
+        outputs (dict): Key to output.
+
+        Returns:
+        None
+        """
+        operations = [
+            ReplaceOne({"_id": key}, {"_id": key, "output": output}, upsert=True)
+            for key, output in outputs.items()
+        ]
+
+        for start in range(0, len(operations), self.batch_size):
+            self.collection.bulk_write(
+                operations[start : start + self.batch_size], ordered=False
+            )
+
+    def report(self, name):
+        """
+        Print the number of cache hits and misses.
+
+        Parameters:
+        name (str): Name of the cached results, used in the message.
+
+        Returns:
+        None
+        """
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        print(
+            f"{name} cache: {self.hits} hits, {self.misses} misses "
+            f"({hit_rate:.1%} hit rate)."
+        )
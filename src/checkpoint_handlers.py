@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import json
+import os
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+class CheckpointJournal:
+    def __init__(self, path, version=None):
+        """
+        Initialize the CheckpointJournal, an append-only JSON Lines file of
+        (key, output) records that lets long-running stages resume by key.
+
+        Parameters:
+        path (str): The path to the journal file.
+        version (str): Identifier of the stage inputs, e.g. an inputs hash. A journal
+        written for another version is discarded instead of resumed.
+        """
+        self.path = path
+        self.version = version
+
+    def load(self):
+        """
+        Load the records of a previous run.
+
+        Returns:
+        dict: Key to output of every complete record, empty if there is nothing to resume.
+        """
+        records = {}
+
+        if not os.path.exists(self.path):
+            return records
+
+        with open(self.path) as f:
+            header = f.readline()
+            if not header.endswith("\n") or json.loads(header) != {
+                "version": self.version
+            }:
+                print(f"Discarding checkpoint '{self.path}' of other inputs.")
+                self.remove()
+                return records
+
+            end = f.tell()
+            for line in iter(f.readline, ""):
+                # A run interrupted mid-write may leave a truncated last line.
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                records[record["key"]] = record["output"]
+                end = f.tell()
+
+        # Drop any truncated line so that new records start on a line of their own.
+        with open(self.path, "r+") as f:
+            f.truncate(end)
+
+        print(f"Resuming from checkpoint '{self.path}' with {len(records)} records.")
+        return records
+
+    def append(self, records):
+        """
+        Append records to the journal and flush them to disk.
+
+        Parameters:
+        records (dict): Key to JSON-serializable output.
+
+        Returns:
+        None
+        """
+        is_new = not os.path.exists(self.path)
+        if is_new:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        with open(self.path, "a") as f:
+            if is_new:
+                f.write(json.dumps({"version": self.version}) + "\n")
+            for key, output in records.items():
+                f.write(json.dumps({"key": key, "output": output}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        """
+        Remove the journal once its stage has saved its final results.
+
+        Returns:
+        None
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -3,7 +3,10 @@
 
 import argparse
 import ast
+import copy
 import gc
+import multiprocessing
+import os
 import pickle
 
 import numpy as np
@@ -14,7 +17,9 @@ from sentence_transformers import SentenceTransformer
 from tqdm import tqdm
 from transformers import AutoModel
 
+from embedding_handlers import EmbeddingStore
 from mongodb_lib import *
+from resource_handlers import available_cpus
 
 # Load MongoDB configuration from YAML file
 config_infra = yaml.load(open("infra-config-pipeline.yaml"), Loader=yaml.FullLoader)
@@ -23,6 +28,12 @@ db, fs, client = connect_to_mongodb(config_infra)
 # Run garbage collection to free up memory.
 gc.collect()
 
+# Embedding models loaded in this process, by (model name, backend).
+loaded_models = {}
+
+# Inference backends: full-precision PyTorch or dynamically quantized int8 linear layers.
+backends = ["fp32", "int8"]
+
 
 def calculate_embeddings(embeddings, model, text):
     """
@@ -47,61 +58,403 @@ def calculate_embeddings(embeddings, model, text):
     return embeddings
 
 
-def get_embeddings(texts, field_name, embedding_model, model_name, average=False):
+def load_embedding_model(embedding_model, backend="fp32"):
     """
-    Generate embeddings for a specified text field using the specified embedding model.
+    Load the specified embedding model, once per process and backend.
+
+    A quantized backend is made from a copy of the fp32 model if it is loaded already,
+    so the model is read from disk once.
+
+    Parameters:
+    embedding_model (str): Name of the embedding model to use.
+    backend (str): "fp32", or "int8" to quantize the linear layers dynamically.
+
+    Returns:
+    object: Embedding model instance.
+    """
+    if (embedding_model, backend) not in loaded_models:
+        if backend not in backends:
+            raise ValueError("Unsupported backend")
+
+        if backend != "fp32" and (embedding_model, "fp32") in loaded_models:
+            # Quantize a copy of the loaded fp32 model rather than reading it again.
+            model = copy.deepcopy(loaded_models[(embedding_model, "fp32")])
+        elif embedding_model == "jinaai/jina-embeddings-v2-base-en":
+            model = AutoModel.from_pretrained(embedding_model, trust_remote_code=True)
+        elif embedding_model == "thenlper/gte-large":
+            model = SentenceTransformer(embedding_model)
+        else:
+            raise ValueError("Unsupported embedding model")
+
+        if backend == "int8":
+            model = torch.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+
+        loaded_models[(embedding_model, backend)] = model
+
+    return loaded_models[(embedding_model, backend)]
+
+
+def release_embedding_model(embedding_model):
+    """
+    Drop every loaded backend of an embedding model to free its memory.
+
+    Parameters:
+    embedding_model (str): Name of the embedding model.
+
+    Returns:
+    None
+    """
+    for backend in backends:
+        loaded_models.pop((embedding_model, backend), None)
+    gc.collect()
+
+
+def store_model_name(model_name, backend):
+    """
+    Name under which embeddings of a model and backend are kept in the embedding store.
+
+    Parameters:
+    model_name (str): Name of the model.
+    backend (str): The inference backend.
+
+    Returns:
+    str: The model name, suffixed with the backend unless it is fp32.
+    """
+    return model_name if backend == "fp32" else f"{model_name}-{backend}"
+
+
+def encode_in_batches(model, texts, batch_size=32):
+    """
+    Generate embeddings for a list of texts in length-sorted batches.
+
+    Sorting by length keeps padding within a batch small. If a batch fails, its
+    texts are encoded one at a time so that a single bad text does not fail the batch.
+
+    Parameters:
+    model (object): Embedding model instance.
+    texts (list): List of texts to generate embeddings for.
+    batch_size (int): Number of texts encoded per model call.
+
+    Returns:
+    np.ndarray: Array of embeddings, one row per text, in the order of texts.
+    """
+    order = np.argsort([len(text) for text in texts], kind="stable")
+    embeddings = [None] * len(texts)
+
+    for start in tqdm(range(0, len(order), batch_size), leave=False):
+        batch_indices = order[start : start + batch_size]
+        batch = [texts[i] for i in batch_indices]
+
+        try:
+            batch_embeddings = model.encode(
+                batch, batch_size=len(batch), show_progress_bar=False
+            )
+        except Exception as e:
+            print(f"Batch encoding error: {e}, encoding texts one by one.")
+            batch_embeddings = []
+            for text in batch:
+                batch_embeddings = calculate_embeddings(batch_embeddings, model, text)
+
+        for i, embedding in zip(batch_indices, batch_embeddings):
+            embeddings[i] = embedding
+
+    return np.array(embeddings)
+
+
+def encode_texts(model, texts, average=False, batch_size=32):
+    """
+    Generate embeddings for a list of texts.
 
     Parameters:
+    model (object): Embedding model instance.
     texts (list): List of texts to generate embeddings for.
+    average (bool): If True, compute average embeddings for multiple values in the same row.
+    batch_size (int): Number of texts encoded per model call.
+
+    Returns:
+    np.ndarray: Array of embeddings, one row per text.
+    """
+    if not average:
+        return encode_in_batches(model, texts, batch_size=batch_size)
+
+    # Flatten the unique values of every row into one list, encode it in batches
+    # and average the embeddings of each row's segment.
+    values = []
+    counts = []
+
+    for text in texts:
+        cleaned_text = list(set(ast.literal_eval(text))) or [""]
+        values.extend(cleaned_text)
+        counts.append(len(cleaned_text))
+
+    value_embeddings = encode_in_batches(model, values, batch_size=batch_size)
+    offsets = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    counts = np.array(counts)[:, None]
+
+    return np.add.reduceat(value_embeddings, offsets, axis=0) / counts
+
+
+def embed_missing(
+    texts,
+    product_codes,
+    field_name,
+    embedding_model,
+    model_name,
+    store,
+    average=False,
+    use_store=True,
+    batch_size=32,
+    backend="fp32",
+    checkpoint_size=1024,
+):
+    """
+    Encode the texts that are not in the embedding store and add them to it.
+
+    Embeddings are written to the store every checkpoint_size texts, so that an
+    interrupted run resumes from the texts already encoded.
+
+    Parameters:
+    texts (list): List of texts to generate embeddings for.
+    product_codes (list): Product codes, one per text.
     field_name (str): Name of the text field.
     embedding_model (str): Name of the embedding model to use.
     model_name (str): Name of the model.
+    store (EmbeddingStore): Store of previously computed embeddings.
     average (bool): If True, compute average embeddings for multiple values in the same row.
+    use_store (bool): If False, re-encode every text regardless of the store.
+    batch_size (int): Number of texts encoded per model call.
+    backend (str): The inference backend.
+    checkpoint_size (int): Number of texts encoded between writes to the store.
 
-    Saves:
-    Torch tensor file containing the embeddings for the specified text field.
+    Returns:
+    dict: Position in texts to embedding, for every text.
     """
-    # Load the appropriate embedding model.
-    if embedding_model == "jinaai/jina-embeddings-v2-base-en":
-        model = AutoModel.from_pretrained(embedding_model, trust_remote_code=True)
-    elif embedding_model == "thenlper/gte-large":
-        model = SentenceTransformer(embedding_model)
+    model_name = store_model_name(model_name, backend)
+
+    if use_store:
+        embeddings = store.lookup(product_codes, field_name, model_name, texts)
     else:
-        raise ValueError("Unsupported embedding model")
+        embeddings = {}
 
-    embeddings = []
+    missing = [i for i in range(len(texts)) if i not in embeddings]
+    print(
+        f"{field_name}: {len(embeddings)} embeddings reused, {len(missing)} to encode."
+    )
 
-    # Generate embeddings for each text entry in the specified column.
-    if average:
-        for text in tqdm(texts):
-            cleaned_text = ast.literal_eval(text)
-            cleaned_text = list(set(cleaned_text))
-            intermediary_r = []
+    if missing:
+        # Load the appropriate embedding model.
+        model = load_embedding_model(embedding_model, backend=backend)
+
+        # Sort by length across checkpoints, so that batches keep little padding.
+        missing = sorted(missing, key=lambda i: len(texts[i]))
+
+        for start in tqdm(range(0, len(missing), checkpoint_size), desc=field_name):
+            chunk = missing[start : start + checkpoint_size]
+            chunk_texts = [texts[i] for i in chunk]
+            new_embeddings = encode_texts(
+                model, chunk_texts, average=average, batch_size=batch_size
+            )
+
+            store.update(
+                [product_codes[i] for i in chunk],
+                field_name,
+                model_name,
+                chunk_texts,
+                new_embeddings,
+            )
+            embeddings.update(zip(chunk, new_embeddings))
 
-            for el in cleaned_text:
-                intermediary_r = calculate_embeddings(intermediary_r, model, el)
+    return embeddings
 
-            avg_intermediary = np.mean(np.array(intermediary_r), axis=0)
-            embeddings.append(avg_intermediary)
-    else:
-        for text in tqdm(texts):
-            embeddings = calculate_embeddings(embeddings, model, text)
 
-    # Convert embeddings to a torch tensor and save to file.
-    embeddings = torch.tensor(embeddings)
+def save_embeddings(embeddings, field_name, model_name):
+    """
+    Save the embeddings of a text field as a torch tensor file.
+
+    Parameters:
+    embeddings (list): Embeddings in product order.
+    field_name (str): Name of the text field.
+    model_name (str): Name of the model, suffixed with the backend unless it is fp32.
+
+    Saves:
+    Torch tensor file containing the embeddings for the specified text field.
+    """
+    embeddings = torch.tensor(np.stack(embeddings).astype(np.float32))
     object_name = f"embeddings_{field_name}_{model_name}"
 
     with open(f"tmp/{object_name}", "wb") as f:
         pickle.dump(embeddings, f)
 
 
+def get_embeddings(
+    texts,
+    product_codes,
+    field_name,
+    embedding_model,
+    model_name,
+    store,
+    average=False,
+    use_store=True,
+    batch_size=32,
+    backend="fp32",
+):
+    """
+    Generate embeddings for a specified text field using the specified embedding model.
+
+    Only texts that are new or changed since they were last embedded are encoded;
+    the others are read from the embedding store.
+
+    Parameters:
+    texts (list): List of texts to generate embeddings for.
+    product_codes (list): Product codes, one per text.
+    field_name (str): Name of the text field.
+    embedding_model (str): Name of the embedding model to use.
+    model_name (str): Name of the model.
+    store (EmbeddingStore): Store of previously computed embeddings.
+    average (bool): If True, compute average embeddings for multiple values in the same row.
+    use_store (bool): If False, re-encode every text regardless of the store.
+    batch_size (int): Number of texts encoded per model call.
+    backend (str): The inference backend.
+
+    Saves:
+    Torch tensor file containing the embeddings for the specified text field.
+    """
+    embeddings = embed_missing(
+        texts,
+        product_codes,
+        field_name,
+        embedding_model,
+        model_name,
+        store,
+        average=average,
+        use_store=use_store,
+        batch_size=batch_size,
+        backend=backend,
+    )
+
+    # Assemble the embeddings in product order and save them.
+    save_embeddings(
+        [embeddings[i] for i in range(len(texts))],
+        field_name,
+        store_model_name(model_name, backend),
+    )
+
+
+def init_worker(num_threads):
+    """
+    Initialize an embedding worker process.
+
+    Parameters:
+    num_threads (int): Number of PyTorch threads the worker may use.
+
+    Returns:
+    None
+    """
+    torch.set_num_threads(num_threads)
+
+
+def embed_shard(task):
+    """
+    Encode one shard of a text field in a worker process and write it to the store.
+
+    Workers are started with the spawn method, so each one has its own MongoDB
+    connection (the module-level db) and loads the model at most once.
+
+    Parameters:
+    task (dict): Keyword arguments of embed_missing, except the store.
+
+    Returns:
+    int: The number of texts in the shard.
+    """
+    embed_missing(store=EmbeddingStore(db), **task)
+    return len(task["texts"])
+
+
+def merge_embeddings(
+    texts, product_codes, field_name, model_name, store, backend="fp32"
+):
+    """
+    Assemble the embeddings of all shards from the store in product order and save them.
+
+    Parameters:
+    texts (list): List of embedded texts.
+    product_codes (list): Product codes, one per text.
+    field_name (str): Name of the text field.
+    model_name (str): Name of the model.
+    store (EmbeddingStore): Store the shards were written to.
+    backend (str): The inference backend.
+
+    Saves:
+    Torch tensor file containing the embeddings for the specified text field.
+    """
+    embeddings = store.lookup(
+        product_codes, field_name, store_model_name(model_name, backend), texts
+    )
+
+    if len(embeddings) != len(texts):
+        raise ValueError(
+            f"{len(texts) - len(embeddings)} embeddings of {field_name} ({model_name}) "
+            "are missing from the store, run all shards before merging."
+        )
+
+    save_embeddings(
+        [embeddings[i] for i in range(len(texts))],
+        field_name,
+        store_model_name(model_name, backend),
+    )
+
+
+def check_backend_agreement(embedding_model, texts, backend, batch_size=32):
+    """
+    Report the cosine agreement between fp32 embeddings and those of another backend.
+
+    The fp32 model is loaded first, so the other backend is made from a copy of it.
+
+    Parameters:
+    embedding_model (str): Name of the embedding model.
+    texts (list): Sample of texts to embed with both backends.
+    backend (str): The backend to compare against fp32.
+    batch_size (int): Number of texts encoded per model call.
+
+    Returns:
+    np.ndarray: Cosine similarity between the two embeddings of each text.
+    """
+    reference = encode_texts(
+        load_embedding_model(embedding_model), texts, batch_size=batch_size
+    )
+    candidate = encode_texts(
+        load_embedding_model(embedding_model, backend=backend),
+        texts,
+        batch_size=batch_size,
+    )
+
+    cosines = np.sum(reference * candidate, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    )
+    print(
+        f"{embedding_model} {backend} vs fp32 on {len(texts)} texts: "
+        f"mean cosine {cosines.mean():.4f}, min cosine {cosines.min():.4f}"
+    )
+
+    # Keep only the backend used for the run.
+    loaded_models.pop((embedding_model, "fp32"), None)
+
+    return cosines
+
+
 def main():
     """
     Main function to generate embeddings for product text fields.
 
     Steps:
-    1. Load the summarized product textual data from a pickle file.
-    2. Generate embeddings for specific fields if not already present.
+    1. Skip the embedding models whose embedding files were computed from the same
+       texts, model and backend, and load the product textual data from MongoDB.
+    2. For each remaining embedding model, generate embeddings for specific fields, reusing
+       stored embeddings of unchanged texts and loading the model at most once.
+    3. Optionally split the products across worker processes and/or pods, each
+       writing its shard to the embedding store, and merge the shards in product order.
     """
 
     parser = argparse.ArgumentParser()
@@ -109,78 +462,218 @@ def main():
         "--overwrite", action="store_true", help="Enable overwrite mode"
     )
     parser.add_argument(
-        "--embedding_model", type=str, required=True, help="The embedding model."
+        "--embedding_models",
+        "--embedding_model",
+        type=str,
+        required=True,
+        help="Comma-separated list of embedding models (--embedding_model is kept "
+        "as an alias for a single model).",
+    )
+    parser.add_argument(
+        "--ignore_store",
+        action="store_true",
+        help="Re-encode every text instead of reusing stored embeddings.",
+    )
+    parser.add_argument(
+        "--batch_size", type=int, default=32, help="Texts encoded per model call."
+    )
+    parser.add_argument(
+        "--backend",
+        type=str,
+        default="fp32",
+        choices=backends,
+        help="Inference backend of the embedding models.",
+    )
+    parser.add_argument(
+        "--check_agreement",
+        type=int,
+        default=0,
+        help="Number of descriptions used to compare the backend against fp32.",
+    )
+    parser.add_argument(
+        "--num_workers", type=int, default=1, help="Number of encoding processes."
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=None,
+        help="PyTorch threads per encoding process (defaults to the CPUs allowed by "
+        "the pod's CPU limit / workers).",
+    )
+    parser.add_argument(
+        "--shard_index", type=int, default=0, help="Index of this pod's shard."
+    )
+    parser.add_argument(
+        "--shard_count",
+        type=int,
+        default=1,
+        help="Number of pods sharing the products. With more than one shard, "
+        "embeddings are only written to the store until --merge_only is run.",
+    )
+    parser.add_argument(
+        "--merge_only",
+        action="store_true",
+        help="Only assemble the embeddings written by all shards.",
     )
 
     args = parser.parse_args()
 
-    embedding_model = args.embedding_model
-    model_name = embedding_model.split("/")[-1]
+    embedding_models = args.embedding_models.split(",")
 
     field_description = "pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED"
-    embeddings_description_name = f"embeddings_{field_description}_{model_name}"
-    embeddings_description_file = fs.find_one({"filename": embeddings_description_name})
-
     field_inclexcl = "pdt_inclexcl_ENG_CONTENT_translated"
-    embeddings_inclexcl_name = f"embeddings_{field_inclexcl}_{model_name}"
-    embeddings_inclexcl_file = fs.find_one({"filename": embeddings_inclexcl_name})
-
     field_producttitle = "pdt_product_detail_PRODUCTTITLE_translated"
-    embeddings_producttitle_name = f"embeddings_{field_producttitle}_{model_name}"
-    embeddings_producttitle_file = fs.find_one(
-        {"filename": embeddings_producttitle_name}
-    )
-
     field_tourgradedescription = "pdt_product_detail_TOURGRADEDESCRIPTION"
-    embeddings_tourgradedescription_name = (
-        f"embeddings_{field_tourgradedescription}_{model_name}"
-    )
-    embeddings_tourgradedescription_file = fs.find_one(
-        {"filename": embeddings_tourgradedescription_name}
-    )
-
-    if (
-        not embeddings_description_file
-        or not embeddings_inclexcl_file
-        or not embeddings_producttitle_file
-        or not embeddings_tourgradedescription_file
-        or args.overwrite
-    ):
-        # Load the summarized product textual data from a pickle file.
-        df = read_object(fs, "product_textual_english_summarized")
-        df = pd.DataFrame(df)
-
-        df_cont = read_object(fs, "product_textual_english")
-        df_cont = pd.DataFrame(df_cont)
-
-        get_embeddings(
-            texts=list(df[field_description]),
-            field_name=field_description,
-            embedding_model=embedding_model,
-            model_name=model_name,
-        )
 
-        get_embeddings(
-            texts=list(df_cont[field_inclexcl]),
-            field_name=field_inclexcl,
-            embedding_model=embedding_model,
-            model_name=model_name,
+    # Fields to embed, as (source object, field, average over values).
+    fields = [
+        ("product_textual_english_summarized", field_description, False),
+        ("product_textual_english", field_inclexcl, False),
+        ("product_textual_english", field_producttitle, False),
+        ("product_textual_english", field_tourgradedescription, True),
+    ]
+
+    def embedding_paths(embedding_model):
+        model_name = store_model_name(embedding_model.split("/")[-1], args.backend)
+        return [f"tmp/embeddings_{field}_{model_name}" for _, field, _ in fields]
+
+    # The embeddings of a model depend on the texts, the model and the backend.
+    inputs_hashes = {
+        embedding_model: compute_inputs_hash(
+            fs,
+            upstream_objects=sorted({object_name for object_name, _, _ in fields}),
+            params={"embedding_model": embedding_model, "backend": args.backend},
+            input_files=[
+                __file__,
+                os.path.join(os.path.dirname(__file__), "embedding_handlers.py"),
+            ],
         )
-
-        get_embeddings(
-            texts=list(df_cont[field_producttitle]),
-            field_name=field_producttitle,
-            embedding_model=embedding_model,
-            model_name=model_name,
+        for embedding_model in embedding_models
+    }
+
+    pending_models = [
+        embedding_model
+        for embedding_model in embedding_models
+        if args.overwrite
+        or not is_file_up_to_date(
+            embedding_paths(embedding_model), inputs_hashes[embedding_model]
         )
-
-        get_embeddings(
-            texts=list(df_cont[field_tourgradedescription]),
-            field_name=field_tourgradedescription,
-            embedding_model=embedding_model,
-            model_name=model_name,
-            average=True,
+    ]
+
+    if pending_models:
+        # Load the summarized product textual data from MongoDB.
+        dfs = {
+            "product_textual_english_summarized": pd.DataFrame(
+                read_object(fs, "product_textual_english_summarized")
+            ),
+            "product_textual_english": pd.DataFrame(
+                read_object(fs, "product_textual_english")
+            ),
+        }
+
+        store = EmbeddingStore(db)
+        use_store = not args.ignore_store
+
+        threads_per_worker = args.threads_per_worker or max(
+            1, available_cpus() // args.num_workers
         )
+
+        for embedding_model in pending_models:
+            model_name = embedding_model.split("/")[-1]
+
+            if args.check_agreement and args.backend != "fp32":
+                descriptions = dfs["product_textual_english_summarized"][
+                    field_description
+                ]
+                check_backend_agreement(
+                    embedding_model,
+                    list(
+                        descriptions.sample(
+                            min(args.check_agreement, len(descriptions)),
+                            random_state=0,
+                        )
+                    ),
+                    args.backend,
+                    batch_size=args.batch_size,
+                )
+
+            if args.num_workers > 1 and not args.merge_only:
+                pool = multiprocessing.get_context("spawn").Pool(
+                    args.num_workers,
+                    initializer=init_worker,
+                    initargs=(threads_per_worker,),
+                )
+
+            for object_name, field, average in fields:
+                texts = list(dfs[object_name][field])
+                product_codes = list(dfs[object_name]["PRODUCTCODE"])
+
+                if (
+                    args.num_workers == 1
+                    and args.shard_count == 1
+                    and not args.merge_only
+                ):
+                    get_embeddings(
+                        texts=texts,
+                        product_codes=product_codes,
+                        field_name=field,
+                        embedding_model=embedding_model,
+                        model_name=model_name,
+                        store=store,
+                        use_store=use_store,
+                        batch_size=args.batch_size,
+                        average=average,
+                        backend=args.backend,
+                    )
+                    continue
+
+                if not args.merge_only:
+                    # Contiguous shards of this pod's contiguous shard of products.
+                    shard = np.array_split(np.arange(len(texts)), args.shard_count)[
+                        args.shard_index
+                    ]
+                    tasks = [
+                        {
+                            "texts": [texts[i] for i in part],
+                            "product_codes": [product_codes[i] for i in part],
+                            "field_name": field,
+                            "embedding_model": embedding_model,
+                            "model_name": model_name,
+                            "average": average,
+                            "use_store": use_store,
+                            "batch_size": args.batch_size,
+                            "backend": args.backend,
+                        }
+                        for part in np.array_split(shard, args.num_workers)
+                        if len(part)
+                    ]
+
+                    if args.num_workers > 1:
+                        pool.map(embed_shard, tasks)
+                    else:
+                        for task in tasks:
+                            embed_missing(store=store, **task)
+
+                if args.shard_count == 1 or args.merge_only:
+                    merge_embeddings(
+                        texts,
+                        product_codes,
+                        field,
+                        model_name,
+                        store,
+                        backend=args.backend,
+                    )
+
+            if args.num_workers > 1 and not args.merge_only:
+                pool.close()
+                pool.join()
+
+            # Only a single shard or the merge writes the embedding files.
+            if args.shard_count == 1 or args.merge_only:
+                for path in embedding_paths(embedding_model):
+                    save_file_inputs_hash(path, inputs_hashes[embedding_model])
+
+            release_embedding_model(embedding_model)
     else:
         print("Skipping embeddings.")
 
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import hashlib
+
+import numpy as np
+from bson.binary import Binary
+from pymongo import ASCENDING, UpdateOne
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+class EmbeddingStore:
+    def __init__(self, db, collection_name="embedding_store", batch_size=5000):
+        """
+        Initialize the EmbeddingStore, a MongoDB collection holding one embedding
+        per (PRODUCTCODE, field, model) together with the hash of the embedded text.
+
+        Parameters:
+        db (Database): The MongoDB database object.
+        collection_name (str): The name of the collection storing the embeddings.
+        batch_size (int): The number of documents read or written per round trip.
+        """
+        self.collection = db[collection_name]
+        self.batch_size = batch_size
+        self.collection.create_index(
+            [("PRODUCTCODE", ASCENDING), ("field", ASCENDING), ("model", ASCENDING)],
+            unique=True,
+        )
+
+    @staticmethod
+    def text_hash(text):
+        """
+        Hash a text so that changed descriptions invalidate their stored embedding.
+
+        Parameters:
+        text (str): The embedded text.
+
+        Returns:
+        str: The SHA-256 hex digest of the text.
+        """
+        return hashlib.sha256(str(text).encode()).hexdigest()
+
+    def lookup(self, product_codes, field_name, model_name, texts):
+        """
+        Retrieve the stored embeddings whose text is unchanged.
+
+        Parameters:
+        product_codes (list): Product codes, one per text.
+        field_name (str): Name of the text field.
+        model_name (str): Name of the model.
+        texts (list): The texts to embed, in the same order as product_codes.
+
+        Returns:
+        dict: Position in product_codes to float32 embedding, for cache hits only.
+        """
+        positions = {product_code: i for i, product_code in enumerate(product_codes)}
+        hashes = [self.text_hash(text) for text in texts]
+        cached = {}
+
+        for start in range(0, len(product_codes), self.batch_size):
+            cursor = self.collection.find(
+                {
+                    "field": field_name,
+                    "model": model_name,
+                    "PRODUCTCODE": {
+                        "$in": list(product_codes[start : start + self.batch_size])
+                    },
+                },
+                {"PRODUCTCODE": 1, "text_hash": 1, "embedding": 1},
+            )
+            for document in cursor:
+                i = positions[document["PRODUCTCODE"]]
+                if document["text_hash"] == hashes[i]:
+                    cached[i] = np.frombuffer(document["embedding"], dtype=np.float32)
+
+        return cached
+
+    def update(self, product_codes, field_name, model_name, texts, embeddings):
+        """
+        Insert or replace the stored embeddings of the given products.
+
+        Parameters:
+        product_codes (list): Product codes, one per text.
+        field_name (str): Name of the text field.
+        model_name (str): Name of the model.
+        texts (list): The embedded texts.
+        embeddings (list): The embeddings, in the same order as product_codes.
+
+        Returns:
+        None
+        """
+        operations = [
+            UpdateOne(
+                {"PRODUCTCODE": product_code, "field": field_name, "model": model_name},
+                {
+                    "$set": {
+                        "text_hash": self.text_hash(text),
+                        "embedding": Binary(
+                            np.asarray(embedding, dtype=np.float32).tobytes()
+                        ),
+                    }
+                },
+                upsert=True,
+            )
+            for product_code, text, embedding in zip(product_codes, texts, embeddings)
+        ]
+
+        for start in range(0, len(operations), self.batch_size):
+            self.collection.bulk_write(
+                operations[start : start + self.batch_size], ordered=False
+            )
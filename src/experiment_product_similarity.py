@@ -11,6 +11,7 @@ import yaml
 from oauth2client.service_account import ServiceAccountCredentials
 from tqdm import tqdm
 
+from landmark_handlers import get_product_landmarks
 from mongodb_lib import *
 from openai_handlers import query_gpt_with_history
 
@@ -333,8 +334,10 @@ def main():
 
             if args.start_year != "any":
 
-                df["year"] = pd.to_datetime(df[time_feature], unit="ms")
-                df["year"] = df["year"].dt.year
+                # Dates are datetime strings, as astypestr converts every column.
+                df["year"] = pd.to_datetime(
+                    df[time_feature], errors="coerce", utc=True, format="mixed"
+                ).dt.year
 
                 df = df[df["year"] >= int(args.start_year)]
                 del df["year"]
@@ -350,11 +353,9 @@ def main():
             list_products = list(df_raw[product_field])
 
             idx_product = list_products.index(args.product_id)
-            which_landmarks = one_hot_encoding[idx_product]
-            which_landmarks = [bool(x) for x in which_landmarks]
-            names_landmarks_product = [
-                elem for elem, flag in zip(name_landmarks, which_landmarks) if flag
-            ]
+            names_landmarks_product = get_product_landmarks(
+                one_hot_encoding, name_landmarks, idx_product
+            )
 
             if names_landmarks_product:
 
@@ -367,13 +368,9 @@ def main():
                     for candidate in list(df[product_field]):
 
                         idx_candidate = list_products.index(candidate)
-                        which_landmarks = one_hot_encoding[idx_candidate]
-                        which_landmarks = [bool(x) for x in which_landmarks]
-                        names_landmarks_candidate = [
-                            elem
-                            for elem, flag in zip(name_landmarks, which_landmarks)
-                            if flag
-                        ]
+                        names_landmarks_candidate = get_product_landmarks(
+                            one_hot_encoding, name_landmarks, idx_candidate
+                        )
                         result = landmarks_are_the_same(
                             names_landmarks_product, names_landmarks_candidate
                         )
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import gc
+
+import yaml
+
+from mongodb_lib import *
+from similarity_handlers import find_similar_to_product, hnsw_index_from_bytes
+
+# Load MongoDB configuration from YAML file
+config_infra = yaml.load(open("infra-config-pipeline.yaml"), Loader=yaml.FullLoader)
+db, fs, client = connect_to_mongodb(config_infra)
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+def main():
+    """
+    Main function to look up the most similar products of given products in the HNSW
+    index saved by generate_product_similarity.py --index_backend hnsw.
+
+    Steps:
+    1. Load the product codes, in the order of the indexed embeddings.
+    2. Load the HNSW index from MongoDB.
+    3. Query the index with the embedding of each given product and print its most
+       similar products.
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--embedding_model", type=str, required=True, help="The embedding model."
+    )
+    parser.add_argument(
+        "--embedding_fields", type=str, required=True, help="Embedding fields."
+    )
+    parser.add_argument(
+        "--product_codes",
+        type=str,
+        nargs="+",
+        required=True,
+        help="Product codes to find similar products for.",
+    )
+    parser.add_argument(
+        "--num_similar",
+        type=int,
+        default=10,
+        help="Number of similar products to return per product.",
+    )
+    parser.add_argument(
+        "--ef_search",
+        type=int,
+        default=400,
+        help="HNSW candidate list size at query time (higher is more accurate).",
+    )
+    args = parser.parse_args()
+
+    model_name = args.embedding_model.split("/")[-1]
+    index_object_name = f"hnsw_index_{model_name}_{args.embedding_fields}"
+
+    product_codes = (
+        read_table(fs, "product_textual_english_summarized", columns=["PRODUCTCODE"])
+        .column("PRODUCTCODE")
+        .to_pylist()
+    )
+    product_indices = {code: i for i, code in enumerate(product_codes)}
+
+    index = hnsw_index_from_bytes(
+        read_object(fs, index_object_name), ef_search=args.ef_search
+    )
+
+    for product_code in args.product_codes:
+        if product_code not in product_indices:
+            print(f"Product '{product_code}' not found.")
+            continue
+
+        similar_indices, similarity_scores = find_similar_to_product(
+            index, product_indices[product_code], num_similar=args.num_similar
+        )
+        print(f"Most similar products of '{product_code}':")
+        for similar_index, score in zip(similar_indices, similarity_scores):
+            print(f"  {product_codes[similar_index]}\t{score:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,7 @@ import numpy as np
 from sklearn.decomposition import PCA
 
 from generate_model_embeddings import read_embedding
+from mongodb_lib import *
 
 # Run garbage collection to free up memory.
 gc.collect()
@@ -16,7 +17,8 @@ gc.collect()
 
 def reduce_dimension(concatenated_array, target_dim=1000):
     """
-    Reduce the dimension of the concatenated array using PCA.
+    Reduce the dimension of the concatenated array using PCA, seeded so that the
+    same embeddings always give the same reduced array.
 
     Parameters:
     concatenated_array (np.ndarray): Array containing concatenated embeddings.
@@ -25,7 +27,7 @@ def reduce_dimension(concatenated_array, target_dim=1000):
     Returns:
     np.ndarray: Array with reduced dimensions.
     """
-    pca = PCA(n_components=target_dim)
+    pca = PCA(n_components=target_dim, random_state=0)
     reduced_array = pca.fit_transform(concatenated_array)
     return reduced_array
 
@@ -38,7 +40,8 @@ def main():
     1. Load embeddings from specified embedding models and fields.
     2. Concatenate the loaded embeddings.
     3. Reduce the dimensions of the concatenated embeddings using PCA.
-    4. Save the reduced embeddings as a pickle file.
+    4. Save the reduced embeddings as a pickle file, unless it was computed from the
+       same model embeddings.
     """
 
     parser = argparse.ArgumentParser()
@@ -62,14 +65,19 @@ def main():
 
     object_name = f"model_embeddings_mean_{embedding_fields}"
 
-    if args.overwrite:
+    embedding_paths = [
+        f"tmp/model_embeddings_{em.split('/')[-1]}_{embedding_fields}"
+        for em in embedding_models
+    ]
+    inputs_hash = compute_inputs_hash(
+        None,
+        params={"embedding_models": embedding_models},
+        input_files=[__file__] + embedding_paths,
+    )
 
-        embeddings_list = []
+    if args.overwrite or not is_file_up_to_date([f"tmp/{object_name}"], inputs_hash):
 
-        for em in embedding_models:
-            model_name = em.split("/")[-1]
-            em_path = f"tmp/model_embeddings_{model_name}_{embedding_fields}"
-            embeddings_list.append(read_embedding(em_path))
+        embeddings_list = [read_embedding(path) for path in embedding_paths]
 
         # Concatenate the arrays along the feature axis (axis=1)
         concatenated_array = np.concatenate(embeddings_list, axis=1)
@@ -79,6 +87,7 @@ def main():
 
         with open(f"tmp/{object_name}", "wb") as f:
             pickle.dump(reduced_array, f)
+        save_file_inputs_hash(f"tmp/{object_name}", inputs_hash)
 
     else:
         print("Skipping generation of mean embeddings.")
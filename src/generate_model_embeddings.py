@@ -7,6 +7,8 @@ import pickle
 
 import numpy as np
 
+from mongodb_lib import *
+
 # Run garbage collection to free up memory.
 gc.collect()
 
@@ -35,7 +37,8 @@ def main():
     2. Load the embeddings for 'pdt_inclexcl_ENG_CONTENT'.
     3. Load the embeddings for 'pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED'.
     4. Concatenate the tabular data with the two sets of embeddings.
-    5. Save the final concatenated embeddings as a pickle file.
+    5. Save the final concatenated embeddings as a pickle file, unless it was
+       computed from the same embedding files.
     """
 
     parser = argparse.ArgumentParser()
@@ -58,65 +61,48 @@ def main():
 
     object_name = f"model_embeddings_{model_name}_{embedding_fields}"
 
-    if args.overwrite:
-
-        embeddings = []
-
-        if embedding_fields in [
-            "description_title",
-            "description_inclexcl",
-            "title_inclexcl_tgdescription_description",
-        ]:
-            embeddings.append(
-                np.array(
-                    read_embedding(
-                        f"tmp/embeddings_pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED_{model_name}"
-                    )
-                )
-            )
-
-        if embedding_fields in [
-            "title_inclexcl_tgdescription",
-            "description_inclexcl",
-            "title_inclexcl_tgdescription_description",
-        ]:
-            embeddings.append(
-                np.array(
-                    read_embedding(
-                        f"tmp/embeddings_pdt_inclexcl_ENG_CONTENT_translated_{model_name}"
-                    )
-                )
-            )
-
-        if embedding_fields in [
-            "title_inclexcl_tgdescription",
-            "description_title",
-            "title_inclexcl_tgdescription_description",
-        ]:
-            embeddings.append(
-                np.array(
-                    read_embedding(
-                        f"tmp/embeddings_pdt_product_detail_PRODUCTTITLE_translated_{model_name}"
-                    )
-                )
-            )
-
-        if embedding_fields in [
-            "title_inclexcl_tgdescription",
-            "title_inclexcl_tgdescription_description",
-        ]:
-            embeddings.append(
-                np.array(
-                    read_embedding(
-                        f"tmp/embeddings_pdt_product_detail_TOURGRADEDESCRIPTION_{model_name}"
-                    )
-                )
-            )
+    # Embedded fields of each combination, in concatenation order.
+    fields = []
+    if embedding_fields in [
+        "description_title",
+        "description_inclexcl",
+        "title_inclexcl_tgdescription_description",
+    ]:
+        fields.append("pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED")
+    if embedding_fields in [
+        "title_inclexcl_tgdescription",
+        "description_inclexcl",
+        "title_inclexcl_tgdescription_description",
+    ]:
+        fields.append("pdt_inclexcl_ENG_CONTENT_translated")
+    if embedding_fields in [
+        "title_inclexcl_tgdescription",
+        "description_title",
+        "title_inclexcl_tgdescription_description",
+    ]:
+        fields.append("pdt_product_detail_PRODUCTTITLE_translated")
+    if embedding_fields in [
+        "title_inclexcl_tgdescription",
+        "title_inclexcl_tgdescription_description",
+    ]:
+        fields.append("pdt_product_detail_TOURGRADEDESCRIPTION")
+
+    embedding_paths = [f"tmp/embeddings_{field}_{model_name}" for field in fields]
+    inputs_hash = compute_inputs_hash(
+        None,
+        params={"embedding_fields": embedding_fields},
+        input_files=[__file__] + embedding_paths,
+    )
+
+    if args.overwrite or not is_file_up_to_date([f"tmp/{object_name}"], inputs_hash):
+
+        embeddings = [np.array(read_embedding(path)) for path in embedding_paths]
 
         final_embeddings = np.concatenate(embeddings, axis=1)
 
         with open(f"tmp/{object_name}", "wb") as f:
             pickle.dump(final_embeddings, f)
+        save_file_inputs_hash(f"tmp/{object_name}", inputs_hash)
 
     else:
         print("Skipping generation of model embeddings.")
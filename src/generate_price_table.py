@@ -20,7 +20,8 @@ gc.collect()
 
 def main():
     """
-    Main function to fetch latest product prices from BigQuery and save to MongoDB.
+    Main function to fetch latest product prices from BigQuery and save to MongoDB,
+    unless they are unchanged since the last run.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -29,47 +30,63 @@ def main():
     args = parser.parse_args()
 
     object_name = "price_product_tourgrade"
-    existing_file = fs.find_one({"filename": object_name})
-
-    if not existing_file or args.overwrite:
-        client = bigquery.Client()
-
-        # Define your SQL query with ROW_NUMBER() to get the latest SeasonTo for each ProductCode
-        query = """
-            WITH ranked_data AS (
-                SELECT
-                    ProductCode,
-                    TourGradeCode,
-                    SeasonTo,
-                    adult_retail_price,
-                    ROW_NUMBER() OVER (PARTITION BY ProductCode, TourGradeCode ORDER BY SeasonTo DESC) AS row_num
-                FROM
-                    `v_extract1.product_price_time_series`
-            )
+
+    client = bigquery.Client()
+
+    # Define your SQL query with ROW_NUMBER() to get the latest SeasonTo for each ProductCode
+    query = """
+        WITH ranked_data AS (
             SELECT
                 ProductCode,
                 TourGradeCode,
                 SeasonTo,
-                adult_retail_price
+                adult_retail_price,
+                ROW_NUMBER() OVER (PARTITION BY ProductCode, TourGradeCode ORDER BY SeasonTo DESC) AS row_num
             FROM
-                ranked_data
-            WHERE
-                row_num = 1
-        """
-
-        # Run the query and retrieve the data into a DataFrame
-        df = client.query(query).to_dataframe()
-        df["adult_retail_price"] = df["adult_retail_price"].replace("", np.nan)
-        df["adult_retail_price"] = df["adult_retail_price"].astype(float)
-
-        product_stats = (
-            df.groupby(["ProductCode", "TourGradeCode"])["adult_retail_price"]
-            .agg(["mean"])
-            .reset_index()
+                `v_extract1.product_price_time_series`
         )
+        SELECT
+            ProductCode,
+            TourGradeCode,
+            SeasonTo,
+            adult_retail_price
+        FROM
+            ranked_data
+        WHERE
+            row_num = 1
+    """
 
+    # Run the query and retrieve the data into a DataFrame
+    df = client.query(query).to_dataframe()
+    df["adult_retail_price"] = df["adult_retail_price"].replace("", np.nan)
+    df["adult_retail_price"] = df["adult_retail_price"].astype(float)
+
+    # Sort the rows, returned in no particular order, so that the means are the same
+    # for the same data.
+    df = df.sort_values(list(df.columns), kind="stable").reset_index(drop=True)
+
+    product_stats = (
+        df.groupby(["ProductCode", "TourGradeCode"])["adult_retail_price"]
+        .agg(["mean"])
+        .reset_index()
+    )
+
+    # The table only changes with the data, which is hashed once fetched.
+    inputs_hash = compute_inputs_hash(
+        fs, params={"data": hash_dataframe(product_stats)}, input_files=[__file__]
+    )
+
+    if args.overwrite or not is_up_to_date(fs, [object_name], inputs_hash):
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=product_stats, object_name=object_name)
+        save_object(
+            fs=fs,
+            object=product_stats,
+            object_name=object_name,
+            inputs_hash=inputs_hash,
+        )
+
+    else:
+        print("Skipping price table, prices are unchanged.")
 
 
 if __name__ == "__main__":
@@ -3,12 +3,13 @@
 
 import argparse
 import gc
+import os
 
 import yaml
-from ydata_profiling import ProfileReport
 
 from mongodb_lib import *
 from preprocessing_handlers import DataFrameProcessor
+from profiling_handlers import generate_profiling_report, profiling_modes
 
 # Load configuration from YAML files.
 config = yaml.load(open("config.yaml"), Loader=yaml.FullLoader)
@@ -32,7 +33,8 @@ def main():
     1. Initialize a DataFrameProcessor with the product data.
     2. Preprocess the data.
     3. Save the processed tabular and textual data as pickle files.
-    4. Generate and save profiling reports for both tabular and textual data.
+    4. Generate and save profiling reports for both tabular and textual data, unless
+       profiling is off, e.g. because generate_profiling_reports.py runs it separately.
     """
 
     parser = argparse.ArgumentParser()
@@ -40,21 +42,64 @@ def main():
         "--overwrite", action="store_true", help="Enable overwrite mode"
     )
 
+    parser.add_argument(
+        "--reshape",
+        type=str,
+        default="normalized",
+        choices=["normalized", "explode"],
+        help="Reshape each list column independently, or explode their cross product.",
+    )
+    parser.add_argument(
+        "--engine",
+        type=str,
+        default="pandas",
+        choices=["pandas", "polars"],
+        help="Preprocess with pandas, or with a lazy multi-threaded Polars plan.",
+    )
+    parser.add_argument(
+        "--profiling",
+        type=str,
+        default="full",
+        choices=profiling_modes,
+        help="Profiling reports: off, minimal, sample or full.",
+    )
+    parser.add_argument(
+        "--profiling_sample",
+        type=int,
+        default=10000,
+        help="Number of rows profiled in sample mode.",
+    )
+
     args = parser.parse_args()
 
     tabular_object_name = "product_tabular"
-    tabular_existing_file = fs.find_one({"filename": tabular_object_name})
-
     textual_object_name = "product_textual"
-    textual_existing_file = fs.find_one({"filename": textual_object_name})
 
-    if not tabular_existing_file or not textual_existing_file or args.overwrite:
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_tables"],
+        params={
+            "bigquery_config": bigquery_config,
+            "reshape": args.reshape,
+            "engine": args.engine,
+        },
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "preprocessing_handlers.py"),
+        ],
+    )
+
+    if args.overwrite or not is_up_to_date(
+        fs, [tabular_object_name, textual_object_name], inputs_hash
+    ):
         # Initialize the DataFrameProcessor with the product data path and key fields.
         processor = DataFrameProcessor(
             data_path="product_tables",
             key_field=key_field,
             location_field=location_field,
             fs=fs,
+            reshape=args.reshape,
+            engine=args.engine,
         )
 
         # Preprocess the data.
@@ -62,23 +107,39 @@ def main():
 
         # Save the processed tabular data as a pickle file.
         remove_object(fs=fs, object_name=tabular_object_name)
-        save_object(fs=fs, object=processor.df, object_name=tabular_object_name)
+        save_object(
+            fs=fs,
+            object=processor.df,
+            object_name=tabular_object_name,
+            inputs_hash=inputs_hash,
+        )
 
         # Save the processed textual data as a pickle file.
         remove_object(fs=fs, object_name=textual_object_name)
-        save_object(fs=fs, object=processor.df_text, object_name=textual_object_name)
+        save_object(
+            fs=fs,
+            object=processor.df_text,
+            object_name=textual_object_name,
+            inputs_hash=inputs_hash,
+        )
 
-        # Generate a profiling report for the tabular data.
-        tabular_profile = ProfileReport(processor.df, title="Product Tabular Report")
-        # Save the tabular profiling report to an HTML file.
-        tabular_profile.to_file("reports/product-tabular-report.html")
+        # Generate and save a profiling report for the tabular data.
+        generate_profiling_report(
+            processor.df,
+            title="Product Tabular Report",
+            output_file="reports/product-tabular-report.html",
+            mode=args.profiling,
+            sample_size=args.profiling_sample,
+        )
 
-        # Generate a profiling report for the textual data.
-        textual_profile = ProfileReport(
-            processor.df_text, title="Product Textual Report"
+        # Generate and save a profiling report for the textual data.
+        generate_profiling_report(
+            processor.df_text,
+            title="Product Textual Report",
+            output_file="reports/product-textual-report.html",
+            mode=args.profiling,
+            sample_size=args.profiling_sample,
         )
-        # Save the textual profiling report to an HTML file.
-        textual_profile.to_file("reports/product-textual-report.html")
 
     else:
         print("Skipping processing and profiling.")
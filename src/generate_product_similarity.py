@@ -1,14 +1,21 @@
 import argparse
 import gc
+import os
 
 import numpy as np
 import pandas as pd
 import yaml
-from sklearn.metrics.pairwise import cosine_similarity
-from tqdm import tqdm
 
 from generate_model_embeddings import read_embedding
 from mongodb_lib import *
+from similarity_handlers import (
+    build_hnsw_index,
+    build_similarity_dict,
+    find_top_k_similar,
+    hnsw_index_to_bytes,
+    query_hnsw_index,
+    recall_at_k,
+)
 
 # Load MongoDB configuration from YAML file
 config_infra = yaml.load(open("infra-config-pipeline.yaml"), Loader=yaml.FullLoader)
@@ -18,25 +25,6 @@ db, fs, client = connect_to_mongodb(config_infra)
 gc.collect()
 
 
-def find_most_similar_products(embedding, embeddings, num_similar=50):
-    """
-    Find the most similar products based on cosine similarity.
-
-    Parameters:
-    embedding (np.ndarray): The embedding of the given product.
-    embeddings (np.ndarray): The array of embeddings for all products.
-    num_similar (int): The number of similar products to find.
-
-    Returns:
-    tuple: Indices of the most similar products and their similarity scores.
-    """
-    embedding = embedding.reshape(1, -1)
-    similarities = cosine_similarity(embedding, embeddings)[0]
-    similar_indices = similarities.argsort()[-(num_similar + 1) : -1][::-1]
-    similar_scores = similarities[similar_indices]
-    return similar_indices, similar_scores
-
-
 def main():
     """
     Main function to find the most similar products based on embeddings.
@@ -44,7 +32,7 @@ def main():
     Steps:
     1. Check if the similarity data already exists in MongoDB.
     2. If not, load the product textual data and combined embeddings.
-    3. Calculate the most similar products for each product in the dataset.
+    3. Calculate the most similar products for each product in blocks of products.
     4. Save the similarity data to MongoDB.
     """
     parser = argparse.ArgumentParser()
@@ -57,40 +45,122 @@ def main():
     parser.add_argument(
         "--embedding_fields", type=str, required=True, help="Embedding fields."
     )
+    parser.add_argument(
+        "--num_similar",
+        type=int,
+        default=200,
+        help="Number of similar products to keep per product.",
+    )
+    parser.add_argument(
+        "--block_size",
+        type=int,
+        default=1024,
+        help="Number of products scored per matrix product (caps peak memory).",
+    )
+    parser.add_argument(
+        "--index_backend",
+        type=str,
+        default="exact",
+        choices=["exact", "hnsw"],
+        help="Exact brute-force search or an approximate HNSW index.",
+    )
+    parser.add_argument(
+        "--ef_search",
+        type=int,
+        default=400,
+        help="HNSW candidate list size at query time (higher is more accurate).",
+    )
+    parser.add_argument(
+        "--recall_sample",
+        type=int,
+        default=1000,
+        help="Number of products used to report HNSW recall against exact search.",
+    )
     args = parser.parse_args()
 
     embedding_model = args.embedding_model
     model_name = embedding_model.split("/")[-1]
     embedding_fields = args.embedding_fields
     object_name = f"product_similarities_{model_name}_{embedding_fields}"
-    existing_file = fs.find_one({"filename": object_name})
+    index_object_name = f"hnsw_index_{model_name}_{embedding_fields}"
+    embeddings_path = f"tmp/model_embeddings_{model_name}_{embedding_fields}"
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_textual_english_summarized"],
+        params={
+            "num_similar": args.num_similar,
+            "index_backend": args.index_backend,
+            "ef_search": args.ef_search,
+        },
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "similarity_handlers.py"),
+            embeddings_path,
+        ],
+    )
+
+    object_names = [object_name]
+    if args.index_backend == "hnsw":
+        object_names.append(index_object_name)
 
-    if not existing_file or args.overwrite:
+    if args.overwrite or not is_up_to_date(fs, object_names, inputs_hash):
         df = read_object(fs, "product_textual_english_summarized")
         df = pd.DataFrame(df)
-        combined_embeddings = read_embedding(
-            f"tmp/model_embeddings_{model_name}_{embedding_fields}"
-        )
+        combined_embeddings = read_embedding(embeddings_path)
         combined_embeddings = np.array(combined_embeddings)
-        similarity_dict = {}
-
-        for given_product_index in tqdm(
-            range(len(df["PRODUCTCODE"])), desc="Calculating similarities"
-        ):
-            given_embedding = combined_embeddings[given_product_index]
-            most_similar_indices, similarity_scores = find_most_similar_products(
-                given_embedding, combined_embeddings, num_similar=200
+
+        if args.index_backend == "hnsw":
+            # Build the index and persist it in MongoDB, so that single products
+            # can be looked up later with find_similar_products.py.
+            index = build_hnsw_index(combined_embeddings, ef_search=args.ef_search)
+            remove_object(fs=fs, object_name=index_object_name)
+            save_object(
+                fs=fs,
+                object=hnsw_index_to_bytes(index),
+                object_name=index_object_name,
+                inputs_hash=inputs_hash,
             )
-            similar_products = [
-                df["PRODUCTCODE"].iloc[el] for el in most_similar_indices
-            ]
-            similarity_scores = [str(x) for x in similarity_scores]
-            similarity_dict[df["PRODUCTCODE"].iloc[given_product_index]] = list(
-                zip(similar_products, similarity_scores)
+
+            most_similar_indices, similarity_scores = query_hnsw_index(
+                index,
+                combined_embeddings,
+                num_similar=args.num_similar,
+                block_size=args.block_size,
             )
 
+            # Report recall against exact search on a sample of products.
+            rng = np.random.default_rng(0)
+            sample = rng.choice(
+                len(combined_embeddings),
+                size=min(args.recall_sample, len(combined_embeddings)),
+                replace=False,
+            )
+            exact_indices, _ = find_top_k_similar(
+                combined_embeddings,
+                num_similar=args.num_similar,
+                block_size=args.block_size,
+                query_indices=sample,
+            )
+            recall = recall_at_k(most_similar_indices[sample], exact_indices)
+            print(f"HNSW recall@{args.num_similar} on {len(sample)} products: {recall}")
+
+        else:
+            most_similar_indices, similarity_scores = find_top_k_similar(
+                combined_embeddings,
+                num_similar=args.num_similar,
+                block_size=args.block_size,
+            )
+        similarity_dict = build_similarity_dict(
+            list(df["PRODUCTCODE"]), most_similar_indices, similarity_scores
+        )
+
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=similarity_dict, object_name=object_name)
+        save_object(
+            fs=fs,
+            object=similarity_dict,
+            object_name=object_name,
+            inputs_hash=inputs_hash,
+        )
 
     else:
         print("Skipping product similarity.")
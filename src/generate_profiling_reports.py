@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+import gc
+import os
+
+import yaml
+
+from mongodb_lib import *
+from profiling_handlers import generate_profiling_report, profiling_modes
+
+# Load MongoDB configuration from YAML file
+config_infra = yaml.load(open("infra-config-pipeline.yaml"), Loader=yaml.FullLoader)
+db, fs, client = connect_to_mongodb(config_infra)
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+def main():
+    """
+    Main function to generate the profiling reports of the product data, separately
+    from generate_product_data.py so that it can run in parallel with the rest of the
+    pipeline.
+
+    Steps:
+    1. Load the processed tabular data from MongoDB and profile it.
+    2. Load the processed textual data from MongoDB and profile it.
+
+    A report is skipped if it was generated from the same data and parameters.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--overwrite", action="store_true", help="Enable overwrite mode"
+    )
+    parser.add_argument(
+        "--profiling",
+        type=str,
+        default="full",
+        choices=profiling_modes,
+        help="Profiling reports: off, minimal, sample or full.",
+    )
+    parser.add_argument(
+        "--profiling_sample",
+        type=int,
+        default=10000,
+        help="Number of rows profiled in sample mode.",
+    )
+
+    args = parser.parse_args()
+
+    reports = [
+        (
+            "product_tabular",
+            "Product Tabular Report",
+            "reports/product-tabular-report.html",
+        ),
+        (
+            "product_textual",
+            "Product Textual Report",
+            "reports/product-textual-report.html",
+        ),
+    ]
+
+    for object_name, title, output_file in reports:
+        inputs_hash = compute_inputs_hash(
+            fs,
+            upstream_objects=[object_name],
+            params={
+                "profiling": args.profiling,
+                "profiling_sample": args.profiling_sample,
+            },
+            input_files=[
+                __file__,
+                os.path.join(os.path.dirname(__file__), "profiling_handlers.py"),
+            ],
+        )
+
+        if not args.overwrite and is_file_up_to_date([output_file], inputs_hash):
+            print(f"Skipping profiling report '{title}'.")
+            continue
+
+        # Generate and save a profiling report for the data.
+        df = read_dataframe(fs, object_name)
+        profile = generate_profiling_report(
+            df,
+            title=title,
+            output_file=output_file,
+            mode=args.profiling,
+            sample_size=args.profiling_sample,
+        )
+        if profile is not None:
+            save_file_inputs_hash(output_file, inputs_hash)
+        del df
+        gc.collect()
+
+
+if __name__ == "__main__":
+    main()
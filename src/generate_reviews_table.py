@@ -19,7 +19,8 @@ gc.collect()
 
 def main():
     """
-    Main function to fetch aggregated product reviews from BigQuery and save to MongoDB.
+    Main function to fetch aggregated product reviews from BigQuery and save to MongoDB,
+    unless they are unchanged since the last run.
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -28,18 +29,27 @@ def main():
     args = parser.parse_args()
 
     object_name = "reviews_product"
-    existing_file = fs.find_one({"filename": object_name})
 
-    if not existing_file or args.overwrite:
+    client = bigquery.Client()
 
-        client = bigquery.Client()
+    query = f"SELECT * FROM ww-da-ingestion.v_extract1.pdt_reviews_aggregated"
 
-        query = f"SELECT * FROM ww-da-ingestion.v_extract1.pdt_reviews_aggregated"
+    # Sort the rows, returned in no particular order, so that the same data is saved
+    # with the same content hash.
+    df = client.query(query).to_dataframe()
+    df = df.sort_values(list(df.columns), kind="stable").reset_index(drop=True)
 
-        df = client.query(query).to_dataframe()
+    # The table only changes with the data, which is hashed once fetched.
+    inputs_hash = compute_inputs_hash(
+        fs, params={"data": hash_dataframe(df)}, input_files=[__file__]
+    )
 
+    if args.overwrite or not is_up_to_date(fs, [object_name], inputs_hash):
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=df, object_name=object_name)
+        save_object(fs=fs, object=df, object_name=object_name, inputs_hash=inputs_hash)
+
+    else:
+        print("Skipping reviews table, reviews are unchanged.")
 
 
 if __name__ == "__main__":
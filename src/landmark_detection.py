@@ -1,15 +1,20 @@
 import argparse
 import gc
-import re
-import unicodedata
+import multiprocessing
+import os
 from collections import defaultdict
 
-import numpy as np
-import pandas as pd
+import scipy.sparse as sp
 import yaml
 from tqdm import tqdm
 
+from landmark_handlers import (
+    LandmarkMatcher,
+    build_landmark_encoding,
+    generate_variations,
+)
 from mongodb_lib import *
+from resource_handlers import available_cpus
 
 # Load MongoDB configuration from YAML file
 config_infra = yaml.load(open("infra-config-pipeline.yaml"), Loader=yaml.FullLoader)
@@ -18,75 +23,10 @@ db, fs, client = connect_to_mongodb(config_infra)
 # Run garbage collection to free up memory.
 gc.collect()
 
-
-def find_mentioned_landmarks(description, candidates):
-    """
-    Finds landmarks mentioned in the description based on given candidates.
-
-    Args:
-        description (str): The text description to search.
-        candidates (dict): Dictionary of variations of landmarks to search for.
-
-    Returns:
-        list: List of mentioned landmarks found in the description.
-    """
-    description = remove_accents(description).lower()
-
-    mentioned_landmarks = []
-
-    for landmark in candidates:
-        # Check if the landmark or its aliases are mentioned in the description
-        if landmark in description:
-            mentioned_landmarks.append(landmark)
-        else:
-            # Add fuzzy matching or other checks as needed for variations or typos
-            pass
-
-    return mentioned_landmarks
-
-
-def remove_accents(input_str):
-    """
-    Removes accents from characters in the input string.
-
-    Args:
-        input_str (str): The input string containing accented characters.
-
-    Returns:
-        str: String without accents.
-    """
-    nfkd_form = unicodedata.normalize("NFKD", input_str)
-    return "".join([c for c in nfkd_form if not unicodedata.combining(c)])
-
-
-def generate_variations(keyword):
-    """
-    Generates variations of a keyword including its alternative names in parentheses.
-
-    Args:
-        keyword (str): The original keyword possibly containing alternative names.
-
-    Returns:
-        set: Set of variations (lowercase) of the keyword.
-    """
-    variations = set()
-
-    # Original keyword
-    variations.add(keyword.lower())
-    variations.add(remove_accents(keyword).lower())
-
-    # Alternative names in parentheses
-    match = re.match(r"(.+)\((.+)\)", keyword)
-
-    if match:
-        base_name = match.group(1).strip()
-        alt_name = match.group(2).strip()
-        variations.add(base_name.lower())
-        variations.add(remove_accents(base_name).lower())
-        variations.add(alt_name.lower())
-        variations.add(remove_accents(alt_name).lower())
-
-    return variations
+# Matcher and landmark vocabulary, set before the worker processes are forked so that
+# they share them copy-on-write instead of receiving a pickled copy.
+matcher = None
+all_landmarks = None
 
 
 def flatten_dict(d):
@@ -108,35 +48,79 @@ def flatten_dict(d):
     return list(sorted(set(flattened_keys)))
 
 
+def match_shard(shard):
+    """
+    Finds the landmarks mentioned in a shard of products.
+
+    Args:
+        shard (tuple): The destination cities and the texts of the products.
+
+    Returns:
+        sp.csr_matrix: The sparse landmark encoding of the shard.
+    """
+    cities, texts = shard
+    return build_landmark_encoding(
+        [matcher.match(text, city) for city, text in zip(cities, texts)],
+        all_landmarks,
+    )
+
+
 def main():
     """
     Main function to perform landmark detection and save results to MongoDB.
     """
+    global matcher, all_landmarks
+
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "--overwrite", action="store_true", help="Enable overwrite mode"
     )
+    parser.add_argument(
+        "--text_fields",
+        type=str,
+        default="pdt_product_detail_PRODUCTDESCRIPTION_translated",
+        help="Comma-separated textual fields scanned for landmarks.",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=available_cpus(),
+        help="Number of processes scanning product shards (defaults to the CPUs "
+        "allowed by the pod's CPU limit).",
+    )
+    parser.add_argument(
+        "--shard_size", type=int, default=5000, help="Products per shard."
+    )
     args = parser.parse_args()
 
-    object_name_one_hot_encoding = "one_hot_encoding_landmarks"
-    existing_file_one_hot_encoding = fs.find_one(
-        {"filename": object_name_one_hot_encoding}
-    )
+    text_fields = args.text_fields.split(",")
 
+    object_name_one_hot_encoding = "one_hot_encoding_landmarks"
     object_name_landmarks = "name_landmarks"
-    existing_file_name_landmarks = fs.find_one({"filename": object_name_landmarks})
 
-    if (
-        not existing_file_one_hot_encoding
-        or not existing_file_name_landmarks
-        or args.overwrite
-    ):
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_tabular", "product_textual_english"],
+        params={"text_fields": text_fields},
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "landmark_handlers.py"),
+            "landmarks.yaml",
+        ],
+    )
 
-        df = read_object(fs, "product_tabular")
-        df_text_sum = read_object(fs, "product_textual_english")
+    if args.overwrite or not is_up_to_date(
+        fs, [object_name_one_hot_encoding, object_name_landmarks], inputs_hash
+    ):
 
-        df = pd.DataFrame(df)
-        df_text_sum = pd.DataFrame(df_text_sum)
+        df = read_dataframe(
+            fs,
+            "product_tabular",
+            columns=["PRODUCTCODE", "pdt_product_detail_VIDESTINATIONCITY"],
+        )
+        df_text_sum = read_dataframe(
+            fs, "product_textual_english", columns=["PRODUCTCODE"] + text_fields
+        )
 
         df.fillna("", inplace=True)
         df_text_sum.fillna("", inplace=True)
@@ -157,42 +141,53 @@ def main():
                     variations_dict[city][variation] = place
 
         all_landmarks = flatten_dict(variations_dict)
-        one_hot_encoding = []
-
-        for city, text_summarized in tqdm(
-            zip(
-                list(df["pdt_product_detail_VIDESTINATIONCITY"]),
-                list(df_text_sum["pdt_product_detail_PRODUCTDESCRIPTION_translated"]),
-            ),
-            total=len(df),
-        ):
 
-            candidates = variations_dict[city]
+        # Build the automatons once, then scan each product's texts in a single pass.
+        matcher = LandmarkMatcher(variations_dict)
 
-            mentioned_landmarks = find_mentioned_landmarks(text_summarized, candidates)
-            mentioned_landmarks = list(
-                sorted(set([candidates[el] for el in mentioned_landmarks]))
+        # Fields are joined by newlines, which no landmark variation spans.
+        cities = list(df["pdt_product_detail_VIDESTINATIONCITY"])
+        texts = df_text_sum[text_fields].astype(str).agg("\n".join, axis=1).tolist()
+        shards = [
+            (
+                cities[start : start + args.shard_size],
+                texts[start : start + args.shard_size],
             )
+            for start in range(0, len(df), args.shard_size)
+        ]
+
+        # Store the landmarks as a sparse products x landmarks matrix, whose column ids
+        # index the all_landmarks vocabulary. Shards are stacked in product order.
+        if args.num_workers > 1 and len(shards) > 1:
+            with multiprocessing.get_context("fork").Pool(args.num_workers) as pool:
+                encodings = list(
+                    tqdm(pool.imap(match_shard, shards), total=len(shards))
+                )
+        else:
+            encodings = [match_shard(shard) for shard in tqdm(shards)]
 
-            one_hot_encoding_now = []
-
-            for landmark in all_landmarks:
-                if landmark in mentioned_landmarks:
-                    one_hot_encoding_now.append(1)
-                else:
-                    one_hot_encoding_now.append(0)
-
-            one_hot_encoding.append(one_hot_encoding_now)
-
-        one_hot_encoding = np.array(one_hot_encoding)
+        one_hot_encoding = sp.vstack(
+            encodings or [build_landmark_encoding([], all_landmarks)], format="csr"
+        )
 
         remove_object(fs=fs, object_name=object_name_one_hot_encoding)
         save_object(
-            fs=fs, object=one_hot_encoding, object_name=object_name_one_hot_encoding
+            fs=fs,
+            object=one_hot_encoding,
+            object_name=object_name_one_hot_encoding,
+            inputs_hash=inputs_hash,
         )
 
         remove_object(fs=fs, object_name=object_name_landmarks)
-        save_object(fs=fs, object=all_landmarks, object_name=object_name_landmarks)
+        save_object(
+            fs=fs,
+            object=all_landmarks,
+            object_name=object_name_landmarks,
+            inputs_hash=inputs_hash,
+        )
+
+    else:
+        print("Skipping landmark detection.")
 
 
 if __name__ == "__main__":
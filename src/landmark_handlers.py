@@ -0,0 +1,149 @@
+import gc
+import re
+import unicodedata
+
+import ahocorasick
+import numpy as np
+import scipy.sparse as sp
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+def remove_accents(input_str):
+    """
+    Removes accents from characters in the input string.
+
+    Args:
+        input_str (str): The input string containing accented characters.
+
+    Returns:
+        str: String without accents.
+    """
+    nfkd_form = unicodedata.normalize("NFKD", input_str)
+    return "".join([c for c in nfkd_form if not unicodedata.combining(c)])
+
+
+def generate_variations(keyword):
+    """
+    Generates variations of a keyword including its alternative names in parentheses.
+
+    Args:
+        keyword (str): The original keyword possibly containing alternative names.
+
+    Returns:
+        set: Set of variations (lowercase) of the keyword.
+    """
+    variations = set()
+
+    # Original keyword
+    variations.add(keyword.lower())
+    variations.add(remove_accents(keyword).lower())
+
+    # Alternative names in parentheses
+    match = re.match(r"(.+)\((.+)\)", keyword)
+
+    if match:
+        base_name = match.group(1).strip()
+        alt_name = match.group(2).strip()
+        variations.add(base_name.lower())
+        variations.add(remove_accents(base_name).lower())
+        variations.add(alt_name.lower())
+        variations.add(remove_accents(alt_name).lower())
+
+    return variations
+
+
+class LandmarkMatcher:
+    def __init__(self, variations_dict):
+        """
+        Initialize the LandmarkMatcher, with one Aho-Corasick automaton per city built
+        once from the variations of its landmarks.
+
+        Args:
+            variations_dict (dict): City to a dictionary of variation to landmark.
+        """
+        self.automatons = {}
+
+        for city, variations in variations_dict.items():
+            automaton = ahocorasick.Automaton()
+            for variation, landmark in variations.items():
+                automaton.add_word(variation, (len(variation), landmark))
+            if len(automaton):
+                automaton.make_automaton()
+                self.automatons[city] = automaton
+
+    def match(self, description, city):
+        """
+        Finds the landmarks of a city mentioned in a description, in a single pass.
+
+        A variation only matches as a whole word, i.e. not inside a longer word.
+
+        Args:
+            description (str): The text description to search.
+            city (str): The destination city of the product.
+
+        Returns:
+            list: Sorted list of the landmarks mentioned in the description.
+        """
+        automaton = self.automatons.get(city)
+        if automaton is None or not description:
+            return []
+
+        text = remove_accents(description).lower()
+        mentioned_landmarks = set()
+
+        for end, (length, landmark) in automaton.iter(text):
+            start = end - length + 1
+            if (start == 0 or not text[start - 1].isalnum()) and (
+                end + 1 == len(text) or not text[end + 1].isalnum()
+            ):
+                mentioned_landmarks.add(landmark)
+
+        return sorted(mentioned_landmarks)
+
+
+def build_landmark_encoding(product_landmarks, vocabulary):
+    """
+    Builds the sparse landmark encoding of the products.
+
+    Args:
+        product_landmarks (list): The list of mentioned landmarks of each product.
+        vocabulary (list): The landmark names, whose positions are the landmark ids.
+
+    Returns:
+        sp.csr_matrix: Products x landmarks matrix with a 1 for each mentioned landmark.
+    """
+    landmark_ids = {landmark: i for i, landmark in enumerate(vocabulary)}
+
+    indptr = np.zeros(len(product_landmarks) + 1, dtype=np.int64)
+    indptr[1:] = np.cumsum([len(landmarks) for landmarks in product_landmarks])
+    indices = np.array(
+        [
+            landmark_ids[landmark]
+            for landmarks in product_landmarks
+            for landmark in landmarks
+        ],
+        dtype=np.int32,
+    )
+
+    return sp.csr_matrix(
+        (np.ones(len(indices), dtype=np.int8), indices, indptr),
+        shape=(len(product_landmarks), len(vocabulary)),
+    )
+
+
+def get_product_landmarks(encoding, vocabulary, product_index):
+    """
+    Looks up the landmarks of a product in the sparse landmark encoding.
+
+    Args:
+        encoding (sp.csr_matrix): The products x landmarks encoding.
+        vocabulary (list): The landmark names, whose positions are the landmark ids.
+        product_index (int): The row of the product in the encoding.
+
+    Returns:
+        list: The names of the landmarks of the product, in vocabulary order.
+    """
+    start, end = encoding.indptr[product_index], encoding.indptr[product_index + 1]
+    return [vocabulary[i] for i in sorted(encoding.indices[start:end])]
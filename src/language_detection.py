@@ -3,14 +3,16 @@
 
 import argparse
 import gc
+import os
 
-import pandas as pd
 import yaml
-from deep_translator import GoogleTranslator
-from langdetect import detect
 from tqdm import tqdm
 
+from cache_handlers import ResultCache
+from checkpoint_handlers import CheckpointJournal
+from language_handlers import load_language_detector, resolve_language_detector
 from mongodb_lib import *
+from translation_handlers import GoogleTranslateBackend, MarianBackend, Translator
 
 # Load MongoDB configuration from YAML file
 config_infra = yaml.load(open("infra-config-pipeline.yaml"), Loader=yaml.FullLoader)
@@ -19,39 +21,92 @@ db, fs, client = connect_to_mongodb(config_infra)
 # Run garbage collection to free up memory.
 gc.collect()
 
+# Columns translated to English.
+translated_columns = [
+    "pdt_inclexcl_ENG_CONTENT",
+    "pdt_product_detail_PRODUCTDESCRIPTION",
+    "pdt_product_detail_PRODUCTTITLE",
+]
 
-def detect_language(text):
+
+def translate_dataframe(df, translator, detector):
     """
-    Detects the language of a given text.
+    Translates the descriptive columns of a batch of products to English.
 
     Parameters:
-    text (str): The text to detect the language of.
+    df (pd.DataFrame): A batch of the textual product data.
+    translator (Translator): The translator, shared across batches.
+    detector (object): The language detector, providing detect_batch.
 
     Returns:
-    str: The detected language code or an empty string if detection fails.
+    pd.DataFrame: The batch with translated columns replacing the original ones.
     """
-    try:
-        return detect(text)
-    except Exception as e:
-        print(f"Language detection error: {e} in {text}")
-        return ""
+    # Fill any missing values with an empty string.
+    df = df.fillna("")
+
+    # Detect the language of each text, column by column.
+    languages = {
+        col: detector.detect_batch(df[col].tolist()) for col in translated_columns
+    }
+    is_foreign = {
+        col: [
+            bool(text) and language != "en"
+            for text, language in zip(df[col], languages[col])
+        ]
+        for col in translated_columns
+    }
+
+    # Translate the distinct non-English texts across all columns at once.
+    translations = iter(
+        translator.translate(
+            [
+                text
+                for col in translated_columns
+                for text, foreign in zip(df[col], is_foreign[col])
+                if foreign
+            ],
+            [
+                language
+                for col in translated_columns
+                for language, foreign in zip(languages[col], is_foreign[col])
+                if foreign
+            ],
+        )
+    )
+
+    for col in translated_columns:
+        df[f"{col}_translated"] = [
+            next(translations) if foreign else text
+            for text, foreign in zip(df[col], is_foreign[col])
+        ]
+
+        # Remove the original column after translation.
+        del df[col]
 
+    return df
 
-def translate_text(text):
+
+def apply_translations(df, translations):
     """
-    Translates a given text to English.
+    Replaces the descriptive columns of a batch of products with their translations.
 
     Parameters:
-    text (str): The text to translate.
+    df (pd.DataFrame): A batch of the textual product data.
+    translations (dict): Product code to a dictionary of translated columns.
 
     Returns:
-    str: The translated text or the original text if translation fails.
+    pd.DataFrame: The batch with translated columns replacing the original ones.
     """
-    try:
-        return GoogleTranslator(source="auto", target="en").translate(text)
-    except Exception as e:
-        print(f"Translation error: {e} in {text}")
-        return text
+    df = df.copy()
+
+    for col in translated_columns:
+        df[f"{col}_translated"] = [
+            translations[product_code][f"{col}_translated"]
+            for product_code in df["PRODUCTCODE"]
+        ]
+        del df[col]
+
+    return df
 
 
 def main():
@@ -59,11 +114,13 @@ def main():
     Main function to process and translate product descriptions.
 
     Steps:
-    1. Load the textual product data from MongoDB.
-    2. Fill any missing values in the DataFrame.
-    3. Detect the language of product descriptions.
-    4. Translate non-English product descriptions to English.
-    5. Filter the DataFrame to include relevant columns.
+    1. Stream the textual product data from MongoDB in batches.
+    2. Fill any missing values in each batch.
+    3. Detect the language of the descriptive texts, column by column.
+    4. Translate the distinct non-English texts to English in batches, reusing cached
+       translations and journaling the results so that an interrupted run resumes
+       from the products already translated.
+    5. Concatenate the translated batches.
     6. Save the processed DataFrame to MongoDB.
     """
 
@@ -71,52 +128,152 @@ def main():
     parser.add_argument(
         "--overwrite", action="store_true", help="Enable overwrite mode"
     )
+    parser.add_argument(
+        "--language_detector",
+        type=str,
+        default="fasttext",
+        choices=["fasttext", "langdetect"],
+        help="Language identification with fastText lid.176 or langdetect.",
+    )
+    parser.add_argument(
+        "--language_model_path",
+        type=str,
+        default="tmp/lid.176.bin",
+        help="Path to the fastText lid.176.bin model, langdetect is used if missing.",
+    )
+    parser.add_argument(
+        "--translation_backend",
+        type=str,
+        default="google",
+        choices=["google", "marian"],
+        help="Remote Google translation or offline local MarianMT models.",
+    )
+    parser.add_argument(
+        "--translation_model",
+        type=str,
+        default="Helsinki-NLP/opus-mt-{source}-en",
+        help="Name or local path of the MarianMT models, formatted with the source language.",
+    )
+    parser.add_argument(
+        "--translation_batch_size",
+        type=int,
+        default=16,
+        help="Texts translated per MarianMT model call.",
+    )
+    parser.add_argument(
+        "--translation_fallback",
+        type=str,
+        default="google",
+        choices=["google", "none"],
+        help="Backend of languages without a MarianMT model, or none.",
+    )
+    parser.add_argument(
+        "--translation_workers",
+        type=int,
+        default=4,
+        help="Maximum number of concurrent Google translation requests.",
+    )
+    parser.add_argument(
+        "--ignore_cache",
+        action="store_true",
+        help="Re-translate every text instead of reusing cached translations.",
+    )
 
     args = parser.parse_args()
 
+    # Hash the detector actually used, which is langdetect if the fastText model is missing.
+    language_detector = resolve_language_detector(
+        args.language_detector, model_path=args.language_model_path
+    )
+
     # Specify the name for the processed textual data in English.
     object_name = "product_textual_english"
-    existing_file = fs.find_one({"filename": object_name})
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_textual"],
+        params={
+            "language_detector": language_detector,
+            "translation_backend": args.translation_backend,
+            "translation_model": (
+                args.translation_model if args.translation_backend == "marian" else None
+            ),
+            "translation_fallback": (
+                args.translation_fallback
+                if args.translation_backend == "marian"
+                else None
+            ),
+        },
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "cache_handlers.py"),
+            os.path.join(os.path.dirname(__file__), "checkpoint_handlers.py"),
+            os.path.join(os.path.dirname(__file__), "language_handlers.py"),
+            os.path.join(os.path.dirname(__file__), "translation_handlers.py"),
+        ],
+    )
 
-    if not existing_file or args.overwrite:
+    if args.overwrite or not is_up_to_date(fs, [object_name], inputs_hash):
 
-        # Load the textual product data from MongoDB.
-        df = read_object(fs, "product_textual")
-        df = pd.DataFrame(df)
+        # Resume from the translations journaled by an interrupted run.
+        journal = CheckpointJournal(
+            "tmp/product_textual_english_journal.jsonl", version=inputs_hash
+        )
+        translations = journal.load()
 
-        # Fill any missing values with an empty string.
-        df.fillna("", inplace=True)
+        # Translate each distinct text once, reusing the translations of previous runs.
+        cache = None if args.ignore_cache else ResultCache(db, "translation_cache")
+        detector = load_language_detector(
+            language_detector, model_path=args.language_model_path
+        )
 
-        # Detect the language of each product description.
-        df["language"] = [
-            detect_language(text)
-            for text in tqdm(df["pdt_product_detail_PRODUCTDESCRIPTION"])
-        ]
-
-        # Translate non-English content to English for specific columns.
-        for col in tqdm(
-            [
-                "pdt_inclexcl_ENG_CONTENT",
-                "pdt_product_detail_PRODUCTDESCRIPTION",
-                "pdt_product_detail_PRODUCTTITLE",
-            ]
-        ):
-            df[f"{col}_translated"] = df.apply(
-                lambda row: translate_text(row[col])
-                if row["language"] != "en"
-                else row[col],
-                axis=1,
+        if args.translation_backend == "marian":
+            backend = MarianBackend(
+                model_template=args.translation_model,
+                batch_size=args.translation_batch_size,
+                fallback=(
+                    GoogleTranslateBackend(max_workers=args.translation_workers)
+                    if args.translation_fallback == "google"
+                    else None
+                ),
             )
+        else:
+            backend = GoogleTranslateBackend(max_workers=args.translation_workers)
+        translator = Translator(backend, cache=cache)
 
-            # Remove the original column after translation.
-            del df[col]
+        def translated_batches():
+            """
+            Stream the textual product data from MongoDB, translated batch by batch.
+            """
+            for df_batch in tqdm(
+                read_object_batches(fs, "product_textual"), desc="Translating"
+            ):
+                df_batch = df_batch.fillna("")
+                pending = ~df_batch["PRODUCTCODE"].isin(list(translations))
 
-        # Remove the 'language' column after translation tasks.
-        del df["language"]
+                if pending.any():
+                    df_translated = translate_dataframe(
+                        df_batch[pending], translator, detector
+                    )
+                    new_translations = df_translated.set_index("PRODUCTCODE")[
+                        [f"{col}_translated" for col in translated_columns]
+                    ].to_dict("index")
+                    journal.append(new_translations)
+                    translations.update(new_translations)
 
-        # Save the processed DataFrame to MongoDB.
+                yield apply_translations(df_batch, translations)
+
+        # Save the processed batches to MongoDB as they are translated.
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=df, object_name=object_name)
+        save_dataframe_batches(
+            fs=fs,
+            batches=translated_batches(),
+            object_name=object_name,
+            inputs_hash=inputs_hash,
+        )
+        journal.remove()
+
+        if cache is not None:
+            cache.report("Translation")
 
     else:
         print("Skipping language detection.")
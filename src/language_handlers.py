@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import os
+
+import fasttext
+from langdetect import DetectorFactory, detect
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+class LangdetectDetector:
+    def __init__(self, seed=0):
+        """
+        Initialize the LangdetectDetector, which identifies languages with langdetect.
+
+        Parameters:
+        seed (int): Seed of langdetect's sampling, so that results are deterministic.
+        """
+        DetectorFactory.seed = seed
+        self.name = "langdetect"
+
+    def detect_text(self, text):
+        """
+        Detect the language of a single text.
+
+        Parameters:
+        text (str): The text to detect the language of.
+
+        Returns:
+        str: The detected language code or an empty string if detection fails.
+        """
+        try:
+            return detect(text)
+        except Exception as e:
+            print(f"Language detection error: {e} in {text}")
+            return ""
+
+    def detect_batch(self, texts):
+        """
+        Detect the language of each distinct non-empty text once.
+
+        Parameters:
+        texts (list): The texts to detect the language of.
+
+        Returns:
+        list: The detected language codes, in the same order as texts. Empty texts and
+        failed detections get an empty string.
+        """
+        languages = {
+            text: self.detect_text(text) for text in dict.fromkeys(texts) if text
+        }
+        return [languages.get(text, "") for text in texts]
+
+
+class FastTextDetector:
+    def __init__(self, model_path="tmp/lid.176.bin", threshold=0.0):
+        """
+        Initialize the FastTextDetector, which identifies languages in batches with the
+        fastText lid.176 model.
+
+        Parameters:
+        model_path (str): The path to the lid.176.bin model file.
+        threshold (float): Minimum probability of a detection, below it the language is
+        reported as undetected.
+        """
+        self.model = fasttext.load_model(model_path)
+        self.threshold = threshold
+        self.name = "fasttext"
+
+    def detect_batch(self, texts):
+        """
+        Detect the language of each distinct non-empty text once, in one model call.
+
+        Parameters:
+        texts (list): The texts to detect the language of.
+
+        Returns:
+        list: The detected language codes, in the same order as texts. Empty texts and
+        detections below the threshold get an empty string.
+        """
+        distinct = [text for text in dict.fromkeys(texts) if text]
+        if not distinct:
+            return [""] * len(texts)
+
+        # fastText predicts one line at a time.
+        labels, probabilities = self.model.predict(
+            [" ".join(text.split()) for text in distinct], k=1
+        )
+        languages = {
+            text: (
+                label[0].replace("__label__", "")
+                if probability[0] >= self.threshold
+                else ""
+            )
+            for text, label, probability in zip(distinct, labels, probabilities)
+        }
+        return [languages.get(text, "") for text in texts]
+
+
+def resolve_language_detector(detector="fasttext", model_path="tmp/lid.176.bin"):
+    """
+    Resolve the language detector that will actually be used, falling back to
+    langdetect if the fastText model is missing.
+
+    Parameters:
+    detector (str): The requested detector, "fasttext" or "langdetect".
+    model_path (str): The path to the fastText lid.176.bin model file.
+
+    Returns:
+    str: The detector used, "fasttext" or "langdetect".
+    """
+    if detector == "fasttext" and not os.path.exists(model_path):
+        print(f"fastText model '{model_path}' not found, falling back to langdetect.")
+        return "langdetect"
+
+    return detector
+
+
+def load_language_detector(detector="fasttext", model_path="tmp/lid.176.bin", seed=0):
+    """
+    Load a language detector, falling back to langdetect if the fastText model is missing.
+
+    Parameters:
+    detector (str): The detector, "fasttext" or "langdetect".
+    model_path (str): The path to the fastText lid.176.bin model file.
+    seed (int): Seed of langdetect's sampling.
+
+    Returns:
+    object: The detector, providing name and detect_batch.
+    """
+    if resolve_language_detector(detector, model_path) == "fasttext":
+        return FastTextDetector(model_path)
+
+    return LangdetectDetector(seed=seed)
@@ -4,6 +4,7 @@
 import argparse
 import ast
 import gc
+import os
 
 import pandas as pd
 import yaml
@@ -37,9 +38,18 @@ def main():
     apikey = args.apikey
 
     object_name = f"product_textual_english_summarized_categories_walkway"
-    existing_file = fs.find_one({"filename": object_name})
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_textual_english_summarized_categories"],
+        params={"model_name": model_name},
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "openai_handlers.py"),
+            "Categories.xlsx",
+        ],
+    )
 
-    if not existing_file or args.overwrite:
+    if args.overwrite or not is_up_to_date(fs, [object_name], inputs_hash):
 
         taxonomy = pd.read_excel("Categories.xlsx")
 
@@ -136,7 +146,15 @@ def main():
         )
 
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=annotated_data, object_name=object_name)
+        save_object(
+            fs=fs,
+            object=annotated_data,
+            object_name=object_name,
+            inputs_hash=inputs_hash,
+        )
+
+    else:
+        print("Skipping category mapping.")
 
 
 if __name__ == "__main__":
@@ -1,8 +1,17 @@
 import base64
 import gc
+import hashlib
+import io
 import json
 import logging
-
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import scipy.sparse as sp
 from gridfs import GridFS
 from pymongo import MongoClient
 
@@ -11,6 +20,9 @@ logging.basicConfig(level=logging.INFO)
 # Run garbage collection to free up memory.
 gc.collect()
 
+# Rows per Parquet row group, i.e. the granularity of streaming reads.
+PARQUET_ROW_GROUP_SIZE = 10000
+
 
 def connect_to_mongodb(config):
     """
@@ -47,37 +59,245 @@ def connect_to_mongodb(config):
         raise
 
 
-def save_object(fs, object, object_name):
+def serialize_object(object, compress=False):
+    """
+    Serialize an object to bytes using a codec suited to its type.
+
+    NumPy arrays are written in the .npy format (header + raw buffer, optionally
+    zlib-compressed), sparse matrices as CSR in the .npz format, DataFrames as
+    Parquet, bytes as they are, e.g. a saved index file, and anything else, object
+    arrays included, as JSON.
+
+    Parameters:
+    object (any): The object to serialize.
+    compress (bool): Whether to compress array and DataFrame payloads.
+
+    Returns:
+    tuple: The serialized bytes and the metadata describing the codec.
+    """
+    if isinstance(object, np.ndarray) and object.dtype.hasobject:
+        # Object arrays cannot be written without pickle.
+        logging.warning("Falling back to JSON, array has object dtype.")
+
+    elif isinstance(object, np.ndarray):
+        buffer = io.BytesIO()
+        np.save(buffer, np.ascontiguousarray(object), allow_pickle=False)
+        model_bytes = buffer.getvalue()
+        if compress:
+            return zlib.compress(model_bytes), {"format": "npy", "compression": "zlib"}
+        return model_bytes, {"format": "npy", "compression": None}
+
+    if sp.issparse(object):
+        buffer = io.BytesIO()
+        sp.save_npz(buffer, sp.csr_matrix(object), compressed=compress)
+        return buffer.getvalue(), {
+            "format": "npz_csr",
+            "compression": "zip" if compress else None,
+        }
+
+    if isinstance(object, pd.DataFrame):
+        compression = "zstd" if compress else "snappy"
+        try:
+            buffer = io.BytesIO()
+            pq.write_table(
+                pa.Table.from_pandas(object),
+                buffer,
+                compression=compression,
+                row_group_size=PARQUET_ROW_GROUP_SIZE,
+            )
+            return buffer.getvalue(), {"format": "parquet", "compression": compression}
+        except (pa.ArrowException, TypeError, ValueError) as e:
+            # Columns with mixed Python types cannot be typed by Arrow.
+            logging.warning(
+                f"Falling back to JSON, DataFrame is not Parquet-compatible: {e}"
+            )
+            return object.to_json().encode(), {"format": "json", "compression": None}
+
+    if isinstance(object, bytes):
+        return object, {"format": "bytes", "compression": None}
+
+    if hasattr(object, "tolist"):
+        object = object.tolist()
+
+    return json.dumps(object).encode(), {"format": "json", "compression": None}
+
+
+def deserialize_object(model_bytes, metadata):
+    """
+    Deserialize bytes written by serialize_object.
+
+    Arrays are returned as read-only views over the stored buffer (no copy) and
+    files without codec metadata are parsed as JSON, as they were saved before
+    typed codecs existed.
+
+    Parameters:
+    model_bytes (bytes): The serialized object.
+    metadata (dict): The codec metadata stored with the object, or None.
+
+    Returns:
+    any: The deserialized object.
+    """
+    metadata = metadata or {}
+    object_format = metadata.get("format", "json")
+
+    if object_format == "npy":
+        if metadata.get("compression") == "zlib":
+            model_bytes = zlib.decompress(model_bytes)
+        buffer = io.BytesIO(model_bytes)
+        if np.lib.format.read_magic(buffer) == (1, 0):
+            header = np.lib.format.read_array_header_1_0(buffer)
+        else:
+            header = np.lib.format.read_array_header_2_0(buffer)
+        shape, fortran_order, dtype = header
+        array = np.frombuffer(
+            model_bytes, dtype=dtype, count=int(np.prod(shape)), offset=buffer.tell()
+        )
+        return array.reshape(shape, order="F" if fortran_order else "C")
+
+    if object_format == "npz_csr":
+        return sp.load_npz(io.BytesIO(model_bytes))
+
+    if object_format == "parquet":
+        return table_to_dataframe(pq.read_table(pa.BufferReader(model_bytes)))
+
+    if object_format == "bytes":
+        return model_bytes
+
+    return json.loads(model_bytes.decode())
+
+
+def table_to_dataframe(table):
+    """
+    Convert an Arrow table to a DataFrame with list cells as Python lists.
+
+    Parameters:
+    table (pa.Table): The Arrow table.
+
+    Returns:
+    pd.DataFrame: The DataFrame.
+    """
+    df = table.to_pandas()
+
+    # Arrow returns list cells as NumPy arrays; downstream code expects lists.
+    for field in table.schema:
+        if (
+            pa.types.is_list(field.type) or pa.types.is_large_list(field.type)
+        ) and field.name in df.columns:
+            df[field.name] = [
+                x.tolist() if isinstance(x, np.ndarray) else x for x in df[field.name]
+            ]
+
+    return df
+
+
+def save_object(fs, object, object_name, compress=False, inputs_hash=None):
     """
     Save an object to MongoDB GridFS.
 
+    The file metadata records the codec, a hash of the saved content and,
+    if given, the hash of the inputs the object was computed from.
+
     Parameters:
     fs (GridFS): The GridFS object.
     object (any): The object to save.
     object_name (str): The name of the object.
+    compress (bool): Whether to compress array and DataFrame payloads.
+    inputs_hash (str): Hash returned by compute_inputs_hash for this object.
 
     Returns:
     None
     """
     try:
-        # Serializing object to JSON
-        if "embeddings" in object_name and "product_similarities" not in object_name:
-            model_bytes = json.dumps(object.tolist()).encode()
-        elif "one_hot" in object_name:
-            model_bytes = json.dumps(object.tolist()).encode()
-        elif "product_similarities" in object_name or "name_landmarks" in object_name:
-            model_bytes = json.dumps(object).encode()
-        else:
-            model_bytes = object.to_json().encode()
+        # Serializing object with the codec matching its type
+        model_bytes, metadata = serialize_object(object, compress=compress)
+        metadata["content_hash"] = hashlib.sha256(model_bytes).hexdigest()
+        metadata["inputs_hash"] = inputs_hash
 
-        # Saving object to GridFS
-        fs.put(model_bytes, filename=object_name)
+        # Saving object to GridFS along with its codec
+        fs.put(model_bytes, filename=object_name, metadata=metadata)
         logging.info(f"Successfully saved '{object_name}' to MongoDB GridFS.")
 
     except Exception as e:
         logging.error(f"Failed to save '{object_name}' to MongoDB: {e}")
 
 
+class HashingWriter(io.RawIOBase):
+    """
+    Writable file-like object that hashes the bytes it passes on to another file.
+    """
+
+    def __init__(self, file):
+        self.file = file
+        self.content_hash = hashlib.sha256()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.content_hash.update(data)
+        self.file.write(data)
+        return len(data)
+
+
+def save_dataframe_batches(fs, batches, object_name, compress=False, inputs_hash=None):
+    """
+    Save a stream of DataFrame batches to MongoDB GridFS as a single Parquet object.
+
+    Each batch is written as Parquet row groups straight to the GridFS chunks, so
+    only one batch is held in memory at a time. The object is read back like one
+    saved with save_object. Unlike save_object, errors are raised, e.g. from the
+    code producing the batches, after deleting the partially written object.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    batches (iterable): DataFrame batches with the same columns.
+    object_name (str): The name of the object.
+    compress (bool): Whether to compress the Parquet payload.
+    inputs_hash (str): Hash returned by compute_inputs_hash for this object.
+
+    Returns:
+    None
+    """
+    compression = "zstd" if compress else "snappy"
+    grid_in = fs.new_file(filename=object_name)
+    writer = None
+
+    try:
+        sink = HashingWriter(grid_in)
+
+        for batch in batches:
+            # Later batches are cast to the schema of the first one.
+            table = pa.Table.from_pandas(
+                batch,
+                schema=writer.schema if writer is not None else None,
+                preserve_index=False,
+            )
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema, compression=compression)
+            writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_SIZE)
+
+        if writer is not None:
+            writer.close()
+
+        grid_in.metadata = {
+            "format": "parquet",
+            "compression": compression,
+            "content_hash": sink.content_hash.hexdigest(),
+            "inputs_hash": inputs_hash,
+        }
+        grid_in.close()
+        logging.info(f"Successfully saved '{object_name}' to MongoDB GridFS.")
+
+    except Exception as e:
+        # Close the writer before deleting the chunks written so far.
+        if writer is not None and writer.is_open:
+            writer.close()
+        grid_in.abort()
+        logging.error(f"Failed to save '{object_name}' to MongoDB: {e}")
+        raise
+
+
 def read_object(fs, object_name):
     """
     Read an object from MongoDB GridFS.
@@ -97,9 +317,9 @@ def read_object(fs, object_name):
             logging.error(f"Object '{object_name}' not found in MongoDB GridFS.")
             return None
 
-        # Reading and deserializing object
+        # Reading and deserializing object with the codec it was saved with
         model_bytes = file_cursor.read()
-        obj = json.loads(model_bytes.decode())
+        obj = deserialize_object(model_bytes, file_cursor.metadata)
 
         return obj
 
@@ -108,6 +328,241 @@ def read_object(fs, object_name):
         return None
 
 
+def read_object_batches(
+    fs, object_name, batch_size=PARQUET_ROW_GROUP_SIZE, columns=None
+):
+    """
+    Read a DataFrame from MongoDB GridFS as a stream of DataFrame batches.
+
+    Parquet objects are read row group by row group straight from the GridFS
+    chunks, so only one batch is held in memory at a time. Objects saved with
+    other codecs are read whole and then split into batches.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    object_name (str): The name of the object to read.
+    batch_size (int): The maximum number of rows per batch.
+    columns (list): The columns to read. Defaults to all columns.
+
+    Yields:
+    pd.DataFrame: Consecutive batches of rows.
+    """
+    file_cursor = fs.find_one({"filename": object_name})
+
+    if file_cursor is None:
+        logging.error(f"Object '{object_name}' not found in MongoDB GridFS.")
+        return
+
+    metadata = file_cursor.metadata or {}
+
+    if metadata.get("format") == "parquet":
+        parquet_file = pq.ParquetFile(file_cursor)
+        for batch in parquet_file.iter_batches(batch_size=batch_size, columns=columns):
+            yield table_to_dataframe(pa.Table.from_batches([batch]))
+
+    else:
+        df = pd.DataFrame(deserialize_object(file_cursor.read(), metadata))
+        if columns is not None:
+            df = df[columns]
+        for start in range(0, len(df), batch_size):
+            yield df.iloc[start : start + batch_size]
+
+
+def read_dataframe(fs, object_name, columns=None):
+    """
+    Read a DataFrame from MongoDB GridFS without buffering the whole file.
+
+    Parquet row groups are streamed from GridFS and assembled into a single
+    Arrow table, which is converted to pandas once.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    object_name (str): The name of the object to read.
+    columns (list): The columns to read. Defaults to all columns.
+
+    Returns:
+    pd.DataFrame: The DataFrame if found, None otherwise.
+    """
+    try:
+        file_cursor = fs.find_one({"filename": object_name})
+
+        if file_cursor is None:
+            logging.error(f"Object '{object_name}' not found in MongoDB GridFS.")
+            return None
+
+        metadata = file_cursor.metadata or {}
+
+        if metadata.get("format") == "parquet":
+            parquet_file = pq.ParquetFile(file_cursor)
+            table = parquet_file.read(columns=columns)
+            return table_to_dataframe(table)
+
+        df = pd.DataFrame(deserialize_object(file_cursor.read(), metadata))
+        return df[columns] if columns is not None else df
+
+    except Exception as e:
+        logging.error(f"Failed to read '{object_name}' from MongoDB: {e}")
+        return None
+
+
+def read_table(fs, object_name, columns=None):
+    """
+    Read a DataFrame from MongoDB GridFS as an Arrow table.
+
+    Parquet row groups are streamed from GridFS without converting them to pandas.
+    Objects saved with other codecs are read whole and converted from pandas.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    object_name (str): The name of the object to read.
+    columns (list): The columns to read. Defaults to all columns.
+
+    Returns:
+    pa.Table: The table if found, None otherwise.
+    """
+    try:
+        file_cursor = fs.find_one({"filename": object_name})
+
+        if file_cursor is None:
+            logging.error(f"Object '{object_name}' not found in MongoDB GridFS.")
+            return None
+
+        metadata = file_cursor.metadata or {}
+
+        if metadata.get("format") == "parquet":
+            return pq.ParquetFile(file_cursor).read(columns=columns)
+
+        df = pd.DataFrame(deserialize_object(file_cursor.read(), metadata))
+        if columns is not None:
+            df = df[columns]
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    except Exception as e:
+        logging.error(f"Failed to read '{object_name}' from MongoDB: {e}")
+        return None
+
+
+def get_object_version(fs, object_name):
+    """
+    Get a version identifier of an object in MongoDB GridFS.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    object_name (str): The name of the object.
+
+    Returns:
+    str: The content hash of the object (its file id if saved without one), or None if missing.
+    """
+    file = fs.find_one({"filename": object_name})
+
+    if file is None:
+        return None
+
+    metadata = file.metadata or {}
+    return metadata.get("content_hash") or str(file._id)
+
+
+def compute_inputs_hash(fs, upstream_objects=(), params=None, input_files=()):
+    """
+    Hash everything a pipeline stage output depends on.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    upstream_objects (list): Names of the GridFS objects the stage reads.
+    params (dict): Stage parameters such as model names and configuration sections.
+    input_files (list): Local files the output depends on, e.g. the stage source code.
+
+    Returns:
+    str: The SHA-256 hex digest of the inputs.
+    """
+    inputs_hash = hashlib.sha256()
+
+    for object_name in upstream_objects:
+        inputs_hash.update(object_name.encode())
+        inputs_hash.update(str(get_object_version(fs, object_name)).encode())
+
+    inputs_hash.update(json.dumps(params or {}, sort_keys=True, default=str).encode())
+
+    for path in input_files:
+        with open(path, "rb") as f:
+            inputs_hash.update(hashlib.sha256(f.read()).digest())
+
+    return inputs_hash.hexdigest()
+
+
+def is_up_to_date(fs, object_names, inputs_hash):
+    """
+    Check whether objects exist and were computed from the given inputs.
+
+    Parameters:
+    fs (GridFS): The GridFS object.
+    object_names (list): The names of the objects produced by a stage.
+    inputs_hash (str): Hash returned by compute_inputs_hash for the current inputs.
+
+    Returns:
+    bool: True if every object exists with a matching inputs hash, False otherwise.
+    """
+    for object_name in object_names:
+        file = fs.find_one({"filename": object_name})
+
+        if file is None or (file.metadata or {}).get("inputs_hash") != inputs_hash:
+            return False
+
+    return True
+
+
+def hash_dataframe(df):
+    """
+    Hash the content of a DataFrame, e.g. a table fetched from an external source.
+
+    Parameters:
+    df (pd.DataFrame): The DataFrame, with hashable values.
+
+    Returns:
+    str: The SHA-256 hex digest of the columns and values of the DataFrame.
+    """
+    content_hash = hashlib.sha256(json.dumps(list(map(str, df.columns))).encode())
+    content_hash.update(pd.util.hash_pandas_object(df, index=False).to_numpy())
+    return content_hash.hexdigest()
+
+
+def save_file_inputs_hash(path, inputs_hash):
+    """
+    Record the inputs hash of a local file in a <path>.inputs_hash file next to it.
+
+    Parameters:
+    path (str): The path of the file.
+    inputs_hash (str): Hash returned by compute_inputs_hash for this file.
+
+    Returns:
+    None
+    """
+    with open(f"{path}.inputs_hash", "w") as f:
+        f.write(inputs_hash)
+
+
+def is_file_up_to_date(paths, inputs_hash):
+    """
+    Check whether local files exist and were computed from the given inputs.
+
+    Parameters:
+    paths (list): The paths of the files produced by a stage.
+    inputs_hash (str): Hash returned by compute_inputs_hash for the current inputs.
+
+    Returns:
+    bool: True if every file exists with a matching inputs hash, False otherwise.
+    """
+    for path in paths:
+        if not os.path.exists(path) or not os.path.exists(f"{path}.inputs_hash"):
+            return False
+
+        with open(f"{path}.inputs_hash") as f:
+            if f.read() != inputs_hash:
+                return False
+
+    return True
+
+
 def remove_object(fs, object_name):
     """
     Remove an object from MongoDB GridFS.
@@ -156,8 +611,8 @@ def copy_object(fs, source_name, destination_name):
         # Read the source file's content
         source_content = source_file.read()
 
-        # Write the content to the destination file
-        fs.put(source_content, filename=destination_name)
+        # Write the content and its codec metadata to the destination file
+        fs.put(source_content, filename=destination_name, metadata=source_file.metadata)
         logging.info(f"Object copied from '{source_name}' to '{destination_name}'")
         return True
 
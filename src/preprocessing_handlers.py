@@ -2,9 +2,11 @@
 # coding: utf-8
 
 import gc
+import itertools
 
 import numpy as np
 import pandas as pd
+import polars as pl
 from tqdm import tqdm
 
 from mongodb_lib import *
@@ -14,7 +16,16 @@ gc.collect()
 
 
 class DataFrameProcessor:
-    def __init__(self, data_path, key_field, location_field, fs):
+    def __init__(
+        self,
+        data_path,
+        key_field,
+        location_field,
+        fs,
+        reshape="normalized",
+        engine="pandas",
+        categorical_threshold=0.5,
+    ):
         """
         Initialize the DataFrameProcessor with a path to the pickle file.
 
@@ -23,35 +34,72 @@ class DataFrameProcessor:
         key_field (str): The column name to group by.
         location_field (str): The column name that contains the location.
         fs (GridFS): The GridFS object to interact with MongoDB.
+        reshape (str): "normalized" to reshape each column independently, or "explode"
+        to explode all columns into their cross product first.
+        engine (str): "pandas" to preprocess with the pandas steps, or "polars" to run
+        them as one lazy, multi-threaded Polars plan with the same string outputs.
+        categorical_threshold (float): Columns with at most this ratio of distinct values
+        to rows are stored as categoricals.
         """
         self.data_path = data_path
         self.key_field = key_field
         self.location_field = location_field
         self.fs = fs
+        self.reshape = reshape
+        self.engine = engine
+        self.categorical_threshold = categorical_threshold
+
+        # City columns in fallback order, the first one being the location field.
+        self.city_fields = [
+            self.location_field,
+            "pdt_product_level_VIDESTINATIONCITY",
+            "pdt_inclexcl_ENG_VIDESTINATIONCITY",
+        ]
 
     def preprocess(self):
         """
         Preprocess the DataFrame by performing several steps including reading data,
-        exploding columns, filling missing values, merging city data, aggregating fields,
-        creating text DataFrame, and asserting sizes.
+        reshaping it to one row per product with merged city data (either column by
+        column or by exploding, filling missing values and aggregating fields),
+        creating text DataFrame, asserting sizes, and converting the values to strings
+        of compact dtypes.
         """
+        if self.engine == "polars":
+            self.read_table()
+            self.preprocess_polars()
+            self.assert_sizes()
+            self.astypestr()
+            self.compact_dtypes()
+            return
+
         self.read_data()
-        self.explode_dataframe()
-        self.fill_missing_values()
-        self.merge_and_remove_empty_cities()
-        self.aggregate_all_fields()
+        if self.reshape == "explode":
+            self.explode_dataframe()
+            self.fill_missing_values()
+            self.merge_and_remove_empty_cities()
+            self.aggregate_all_fields()
+        else:
+            self.reshape_by_column()
         self.create_text_dataframe()
         self.preprocess_tabular_fields()
         self.preprocess_text_fields()
         self.assert_sizes()
         self.astypestr()
+        self.compact_dtypes()
 
     def read_data(self):
         """
-        Read the data from MongoDB GridFS and convert it to a DataFrame.
+        Read the data from MongoDB GridFS, streaming it into a DataFrame.
+        """
+        self.df = read_dataframe(self.fs, self.data_path)
+        self.df_text = None
+
+    def read_table(self):
+        """
+        Read the data from MongoDB GridFS as an Arrow table, for the Polars engine.
         """
-        self.df = read_object(self.fs, self.data_path)
-        self.df = pd.DataFrame(self.df)
+        self.table = read_table(self.fs, self.data_path)
+        self.df = None
         self.df_text = None
 
     def explode_dataframe(self):
@@ -72,22 +120,16 @@ class DataFrameProcessor:
         """
         Merge city values from multiple columns and drop rows where the location field is NaN.
         """
+        location = self.df[self.location_field]
 
-        def fill_city(row):
-            if pd.isna(row[self.location_field]):
-                if not pd.isna(row["pdt_product_level_VIDESTINATIONCITY"]):
-                    return row["pdt_product_level_VIDESTINATIONCITY"]
-                elif not pd.isna(row["pdt_inclexcl_ENG_VIDESTINATIONCITY"]):
-                    return row["pdt_inclexcl_ENG_VIDESTINATIONCITY"]
-                else:
-                    return np.nan
-            else:
-                return row[self.location_field]
+        # Fall back column by column, positionally since exploded rows share index labels.
+        for field in self.city_fields[1:]:
+            location = location.where(location.notna(), self.df[field].to_numpy())
 
-        self.df[self.location_field] = self.df.apply(fill_city, axis=1)
+        self.df[self.location_field] = location.to_numpy()
 
-        del self.df["pdt_product_level_VIDESTINATIONCITY"]
-        del self.df["pdt_inclexcl_ENG_VIDESTINATIONCITY"]
+        for field in self.city_fields[1:]:
+            del self.df[field]
 
         self.df = self.df.dropna(subset=[self.location_field])
 
@@ -99,6 +141,66 @@ class DataFrameProcessor:
         agg_dict = {col: list for col in columns_to_aggregate}
         self.df = self.df.groupby(self.key_field).agg(agg_dict).reset_index()
 
+    def reshape_by_column(self):
+        """
+        Reshape the DataFrame to one row per product with lists of values, like
+        explode_dataframe followed by aggregate_all_fields, without materializing the
+        cross product of the list columns.
+
+        Each column is exploded on its own into a long format keyed by the key field and
+        regrouped into lists of distinct values. The location of each product is resolved
+        from its city columns, and products without any location are dropped.
+        """
+        columns = list(self.df.columns)
+        codes, keys = pd.factorize(self.df[self.key_field], sort=True)
+        lists = {}
+
+        for col in tqdm(columns):
+            if col != self.key_field:
+                lists[col] = self.explode_distinct(
+                    self.df[col], rows=codes, num_rows=len(keys)
+                )
+
+        # Cities are combined in the column order in which explode_dataframe nests them.
+        nesting = sorted(self.city_fields, key=columns.index)
+        lists[self.location_field] = [
+            self.resolve_locations(dict(zip(nesting, city_lists)))
+            for city_lists in zip(*(lists[field] for field in nesting))
+        ]
+        for field in self.city_fields[1:]:
+            del lists[field]
+
+        self.df = pd.DataFrame(
+            {
+                self.key_field: keys,
+                **{col: lists[col] for col in columns if col in lists},
+            }
+        )
+        self.df = self.df[[len(x) > 0 for x in self.df[self.location_field]]]
+        self.df = self.df.reset_index(drop=True)
+
+    def resolve_locations(self, city_lists):
+        """
+        Resolve the locations of a product from its city columns.
+
+        Parameters:
+        city_lists (dict): City column to the list of values of the product, in the
+        order in which explode_dataframe nests the columns.
+
+        Returns:
+        list: The distinct locations, in the order in which the exploded rows yield them.
+        """
+        locations = {}
+
+        for combination in itertools.product(*city_lists.values()):
+            cities = dict(zip(city_lists, combination))
+            for field in self.city_fields:
+                if pd.notna(cities[field]):
+                    locations[cities[field]] = None
+                    break
+
+        return list(locations)
+
     def create_text_dataframe(self):
         """
         Create a separate DataFrame with descriptive content fields.
@@ -115,45 +217,104 @@ class DataFrameProcessor:
         for del_col in self.descriptive_fields:
             del self.df[del_col]
 
+    @staticmethod
+    def explode_distinct(series, rows=None, num_rows=None, as_str=False, dropna=False):
+        """
+        Explode a column of lists into the distinct values of each row.
+
+        Parameters:
+        series (pd.Series): Column with one list of values per element.
+        rows (np.ndarray): Row of each element, to merge the values of several elements.
+        Defaults to one row per element.
+        num_rows (int): The number of rows. Defaults to the number of elements.
+        as_str (bool): Whether to convert the values to strings, missing values included.
+        dropna (bool): Whether to drop missing values, instead of keeping them as NaN.
+
+        Returns:
+        list: The list of distinct values of each row, in order of first appearance.
+        """
+        if rows is None:
+            rows = np.arange(len(series))
+        if num_rows is None:
+            num_rows = len(series)
+
+        long_series = pd.Series(series.to_numpy(), index=rows).explode()
+        if as_str:
+            long_series = long_series.map(str)
+        elif dropna:
+            long_series = long_series[long_series.notna()]
+        else:
+            long_series = long_series.where(long_series.notna(), np.nan)
+
+        long_df = long_series.rename_axis("row").reset_index(name="value")
+        long_df = long_df.drop_duplicates().sort_values("row", kind="stable")
+
+        # Split the values at the row boundaries instead of grouping them one by one.
+        bounds = np.searchsorted(long_df["row"].to_numpy(), np.arange(num_rows + 1))
+        values = long_df["value"].tolist()
+        return [values[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
     def preprocess_tabular_fields(self):
         """
         Preprocess tabular fields in the DataFrame by reducing to unique values.
+
+        A single unique value is kept as is, several are joined with "; " and none
+        becomes NaN.
         """
         columns_to_aggregate = [col for col in self.df.columns if col != self.key_field]
 
-        def get_unique_value(lst):
-            unique_values = pd.unique(lst)
-            unique_values = [x for x in unique_values if pd.notna(x)]
-            if len(unique_values) == 1:
-                return unique_values[0]
-            elif len(unique_values) == 0:
-                return np.nan
-            else:
-                return "; ".join(unique_values)
-
         for col in tqdm(columns_to_aggregate):
-            self.df[col] = self.df[col].apply(lambda x: get_unique_value(x))
+            self.df[col] = pd.Series(
+                [
+                    self.get_unique_value(unique_values)
+                    for unique_values in self.explode_distinct(
+                        self.df[col], dropna=True
+                    )
+                ],
+                index=self.df.index,
+            )
+
+    @staticmethod
+    def get_unique_value(unique_values):
+        """
+        Reduce the unique values of a tabular field to a single value.
+
+        Parameters:
+        unique_values (list): The distinct non-missing values.
+
+        Returns:
+        any: The value if there is one, NaN if there is none, or the values joined
+        with "; " otherwise.
+        """
+        if len(unique_values) == 1:
+            return unique_values[0]
+        elif len(unique_values) == 0:
+            return np.nan
+        else:
+            return "; ".join(unique_values)
 
     def preprocess_text_fields(self):
         """
         Preprocess text fields in the text DataFrame by joining unique values.
         """
-        self.df_text["pdt_inclexcl_ENG_CONTENT"] = [
-            ". ".join(list(set([str(el) for el in x])))
-            for x in self.df_text["pdt_inclexcl_ENG_CONTENT"]
-        ]
-        self.df_text["pdt_product_detail_PRODUCTDESCRIPTION"] = [
-            ". ".join(list(set([str(el) for el in x])))
-            for x in self.df_text["pdt_product_detail_PRODUCTDESCRIPTION"]
-        ]
-        self.df_text["pdt_product_detail_PRODUCTTITLE"] = [
-            ". ".join(list(set([str(el) for el in x])))
-            for x in self.df_text["pdt_product_detail_PRODUCTTITLE"]
-        ]
-        self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"] = [
-            list(set([str(el) for el in x]))
-            for x in self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"]
-        ]
+        for col in [
+            "pdt_inclexcl_ENG_CONTENT",
+            "pdt_product_detail_PRODUCTDESCRIPTION",
+            "pdt_product_detail_PRODUCTTITLE",
+        ]:
+            self.df_text[col] = [
+                ". ".join(values)
+                for values in self.explode_distinct(self.df_text[col], as_str=True)
+            ]
+
+        # Tour grade descriptions are kept as lists.
+        self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"] = pd.Series(
+            self.explode_distinct(
+                self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"], as_str=True
+            ),
+            index=self.df_text.index,
+            dtype=object,
+        )
 
     def assert_sizes(self):
         """
@@ -163,9 +324,195 @@ class DataFrameProcessor:
 
     def astypestr(self):
         """
-        Convert all values in both DataFrames to strings and replace 'nan' with empty strings.
+        Convert all values in both DataFrames to strings and replace 'nan' and missing
+        values with empty strings.
         """
         self.df = self.df.astype(str)
-        self.df = self.df.replace("nan", "")
+        self.df = self.df.replace("nan", "").fillna("")
         self.df_text = self.df_text.astype(str)
-        self.df_text = self.df_text.replace("nan", "")
+        self.df_text = self.df_text.replace("nan", "").fillna("")
+
+    def compact_dtypes(self):
+        """
+        Store the low-cardinality columns of both DataFrames as categoricals and the
+        other columns as Arrow-backed strings, which the Parquet codec preserves.
+        """
+        self.df = self.to_compact_dtypes(self.df)
+        self.df_text = self.to_compact_dtypes(self.df_text)
+
+    def to_compact_dtypes(self, df):
+        """
+        Convert the string columns of a DataFrame to compact dtypes.
+
+        The key field is kept as strings. Categoricals always include the empty string,
+        so that filling missing values with it downstream keeps them categorical.
+
+        Parameters:
+        df (pd.DataFrame): The DataFrame of strings.
+
+        Returns:
+        pd.DataFrame: The DataFrame with categorical and string[pyarrow] columns.
+        """
+        columns = {}
+
+        for col in df.columns:
+            if col != self.key_field and df[col].nunique() <= (
+                self.categorical_threshold * len(df)
+            ):
+                columns[col] = df[col].astype("category")
+                if "" not in columns[col].cat.categories:
+                    columns[col] = columns[col].cat.add_categories("")
+            else:
+                columns[col] = df[col].astype("string[pyarrow]")
+
+        return pd.DataFrame(columns, index=df.index)
+
+    def distinct_values_polars(self, frame, col, dropna=False, as_str=False):
+        """
+        Plan the distinct values of a column of lists for each key, like
+        explode_distinct, as a lazy Polars query.
+
+        Parameters:
+        frame (pl.LazyFrame): The product tables.
+        col (str): The column of lists.
+        dropna (bool): Whether to drop missing values.
+        as_str (bool): Whether to convert the values to strings, missing values
+        becoming "nan" like str(np.nan).
+
+        Returns:
+        pl.LazyFrame: The key field and the list of distinct values of each key, in
+        order of first appearance.
+        """
+        dtype = frame.collect_schema()[col]
+        values = pl.col(col) if isinstance(dtype, pl.List) else pl.concat_list(col)
+        inner = dtype.inner if isinstance(dtype, pl.List) else dtype
+
+        long_frame = frame.select(self.key_field, values.alias(col)).explode(
+            col, empty_as_null=True
+        )
+        if inner.is_float():
+            long_frame = long_frame.with_columns(pl.col(col).fill_nan(None))
+        if as_str:
+            long_frame = long_frame.with_columns(
+                pl.col(col).cast(pl.String).fill_null("nan")
+            )
+        elif dropna:
+            long_frame = long_frame.drop_nulls(col)
+
+        return (
+            long_frame.unique(
+                subset=[self.key_field, col], keep="first", maintain_order=True
+            )
+            .group_by(self.key_field, maintain_order=True)
+            .agg(pl.col(col))
+        )
+
+    def preprocess_polars(self):
+        """
+        Preprocess the Arrow table into the tabular and text DataFrames with a single
+        lazy Polars plan, executed multi-threaded, producing the same strings as the
+        pandas steps.
+
+        Each column is exploded on its own and reduced to the distinct values of each
+        product, like reshape_by_column. Locations are resolved from the city columns
+        in the order in which explode_dataframe nests them. Tabular fields whose values
+        are not strings are reduced in pandas, so that astypestr formats them alike.
+        """
+        frame = pl.from_arrow(self.table).lazy()
+        frame = frame.filter(pl.col(self.key_field).is_not_null())
+        schema = frame.collect_schema()
+        columns = schema.names()
+
+        descriptive_fields = [
+            "pdt_inclexcl_ENG_CONTENT",
+            "pdt_product_detail_PRODUCTDESCRIPTION",
+            "pdt_product_detail_PRODUCTTITLE",
+            "pdt_product_detail_TOURGRADEDESCRIPTION",
+        ]
+        tabular_fields = [
+            col
+            for col in columns
+            if col not in descriptive_fields
+            and col not in [self.key_field] + self.city_fields[1:]
+        ]
+
+        def is_string(col):
+            dtype = schema[col]
+            inner = dtype.inner if isinstance(dtype, pl.List) else dtype
+            return inner == pl.String
+
+        # Cities are combined in the column order in which explode_dataframe nests them.
+        nesting = sorted(self.city_fields, key=columns.index)
+        locations = self.distinct_values_polars(frame, nesting[0])
+        for field in nesting[1:]:
+            locations = locations.join(
+                self.distinct_values_polars(frame, field), on=self.key_field
+            )
+        for field in nesting:
+            locations = locations.with_columns(pl.col(field).cast(pl.List(pl.String)))
+            locations = locations.explode(field, empty_as_null=True)
+        locations = (
+            locations.select(
+                self.key_field,
+                pl.coalesce(self.city_fields).alias(self.location_field),
+            )
+            .drop_nulls(self.location_field)
+            .unique(keep="first", maintain_order=True)
+            .group_by(self.key_field, maintain_order=True)
+            .agg(pl.col(self.location_field))
+        )
+
+        # Products without any location are dropped by the inner join.
+        products = locations
+        for col in tabular_fields + descriptive_fields:
+            if col == self.location_field:
+                continue
+            products = products.join(
+                self.distinct_values_polars(
+                    frame,
+                    col,
+                    dropna=col in tabular_fields,
+                    as_str=col in descriptive_fields,
+                ),
+                on=self.key_field,
+                how="left",
+            )
+
+        joined = {
+            col: pl.col(col).list.join("; ")
+            for col in tabular_fields
+            if col == self.location_field or is_string(col)
+        }
+        joined.update(
+            {col: pl.col(col).list.join(". ") for col in descriptive_fields[:3]}
+        )
+        products = (
+            products.with_columns(**joined)
+            .sort(self.key_field)
+            .select([self.key_field] + tabular_fields + descriptive_fields)
+            .collect()
+        )
+
+        self.df = products.select([self.key_field] + tabular_fields).to_pandas()
+        self.df_text = products.select(
+            [self.key_field] + descriptive_fields
+        ).to_pandas()
+
+        # Values other than strings are reduced and formatted by pandas.
+        typed_fields = [col for col in tabular_fields if col not in joined]
+        if typed_fields:
+            typed_lists = table_to_dataframe(products.select(typed_fields).to_arrow())
+            for col in typed_fields:
+                self.df[col] = pd.Series(
+                    [
+                        self.get_unique_value(unique_values or [])
+                        for unique_values in typed_lists[col]
+                    ],
+                    index=self.df.index,
+                )
+
+        # Tour grade descriptions are kept as lists, formatted like str(list).
+        self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"] = [
+            str(list(values))
+            for values in self.df_text["pdt_product_detail_TOURGRADEDESCRIPTION"]
+        ]
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+
+from ydata_profiling import ProfileReport
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+# Profiling modes, from cheapest to most expensive.
+profiling_modes = ["off", "minimal", "sample", "full"]
+
+
+def generate_profiling_report(
+    df, title, output_file, mode="full", sample_size=10000, seed=0
+):
+    """
+    Generate a profiling report of a DataFrame and save it to an HTML file.
+
+    Parameters:
+    df (pd.DataFrame): The DataFrame to profile.
+    title (str): The title of the report.
+    output_file (str): The path of the HTML report.
+    mode (str): "off" to skip the report, "minimal" for a minimal report of all rows,
+    "sample" for a full report of a random sample of rows, or "full" for a full report
+    of all rows.
+    sample_size (int): The number of rows profiled in "sample" mode.
+    seed (int): Seed of the row sampling.
+
+    Returns:
+    ProfileReport: The report, or None if profiling is off.
+    """
+    if mode == "off":
+        print(f"Skipping profiling report '{title}'.")
+        return None
+
+    if mode == "sample" and len(df) > sample_size:
+        df = df.sample(n=sample_size, random_state=seed).sort_index()
+        title = f"{title} (sample of {sample_size} rows)"
+
+    profile = ProfileReport(df, title=title, minimal=mode == "minimal")
+    profile.to_file(output_file)
+
+    return profile
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import math
+import os
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+def read_cgroup_cpu_quota():
+    """
+    Read the CPU limit of the container from its cgroup CFS quota.
+
+    Returns:
+    float: The number of CPUs allowed by the quota, or None if there is no quota.
+    """
+    try:
+        # cgroup v2: "<quota> <period>", quota being "max" without a limit.
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return int(quota) / int(period)
+        return None
+    except (OSError, ValueError):
+        pass
+
+    try:
+        # cgroup v1: a quota of -1 means no limit.
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_quota_us") as f:
+            quota = int(f.read())
+        with open("/sys/fs/cgroup/cpu/cpu.cfs_period_us") as f:
+            period = int(f.read())
+        if quota > 0 and period > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+
+    return None
+
+
+def available_cpus():
+    """
+    Count the CPUs this process may use, which on Kubernetes is the pod's CPU limit
+    rather than the host's cores reported by os.cpu_count().
+
+    Returns:
+    int: The number of CPUs allowed by both the CPU affinity and the cgroup quota,
+    at least 1.
+    """
+    cpus = len(os.sched_getaffinity(0))
+
+    quota = read_cgroup_cpu_quota()
+    if quota is not None:
+        cpus = min(cpus, math.floor(quota))
+
+    return max(1, cpus)
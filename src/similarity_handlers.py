@@ -0,0 +1,302 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import os
+import struct
+import tempfile
+
+import hnswlib
+import numpy as np
+from tqdm import tqdm
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+def normalize_embeddings(embeddings):
+    """
+    L2-normalize the embeddings so that dot products equal cosine similarities.
+
+    Parameters:
+    embeddings (np.ndarray): The array of embeddings for all products.
+
+    Returns:
+    np.ndarray: Float32 array of unit-length embeddings (zero rows are left as zeros).
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return embeddings / norms
+
+
+def top_k_from_scores(scores, num_similar):
+    """
+    Select the highest scores of each row in descending order.
+
+    Parameters:
+    scores (np.ndarray): Matrix of similarity scores (one row per query).
+    num_similar (int): The number of scores to keep per row.
+
+    Returns:
+    tuple: Column indices and scores of the top entries, both of shape (rows, num_similar).
+    """
+    num_similar = min(num_similar, scores.shape[1])
+    rows = np.arange(scores.shape[0])[:, None]
+
+    # Partial selection of the top-k columns, then a sort of those k only.
+    if num_similar < scores.shape[1]:
+        top_indices = np.argpartition(scores, -num_similar, axis=1)[:, -num_similar:]
+    else:
+        top_indices = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+
+    top_scores = scores[rows, top_indices]
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+
+    return top_indices[rows, order], top_scores[rows, order]
+
+
+def find_top_k_similar(
+    embeddings, num_similar=200, block_size=1024, query_indices=None, normalized=False
+):
+    """
+    Find the most similar products of each product based on cosine similarity.
+
+    Similarities are computed in blocks of rows with one matrix product per block,
+    so peak memory is bounded by block_size x len(embeddings) scores.
+
+    Parameters:
+    embeddings (np.ndarray): The array of embeddings for all products.
+    num_similar (int): The number of similar products to find.
+    block_size (int): The number of query rows scored per matrix product.
+    query_indices (np.ndarray): Rows to find neighbours for. Defaults to all rows.
+    normalized (bool): Whether the embeddings are already L2-normalized.
+
+    Returns:
+    tuple: Indices of the most similar products and their similarity scores,
+    both of shape (len(query_indices), num_similar). A product is never its own neighbour.
+    """
+    if not normalized:
+        embeddings = normalize_embeddings(embeddings)
+
+    if query_indices is None:
+        query_indices = np.arange(len(embeddings))
+    query_indices = np.asarray(query_indices)
+
+    num_similar = min(num_similar, len(embeddings) - 1)
+    all_indices = np.empty((len(query_indices), num_similar), dtype=np.int64)
+    all_scores = np.empty((len(query_indices), num_similar), dtype=np.float32)
+
+    for start in tqdm(
+        range(0, len(query_indices), block_size), desc="Calculating similarities"
+    ):
+        block = query_indices[start : start + block_size]
+        scores = embeddings[block] @ embeddings.T
+
+        # Exclude each product from its own neighbours.
+        scores[np.arange(len(block)), block] = -np.inf
+
+        indices, block_scores = top_k_from_scores(scores, num_similar)
+        all_indices[start : start + len(block)] = indices
+        all_scores[start : start + len(block)] = block_scores
+
+    return all_indices, all_scores
+
+
+def build_similarity_dict(product_codes, similar_indices, similarity_scores):
+    """
+    Map every product code to its list of (similar product code, score) pairs.
+
+    Parameters:
+    product_codes (list): Product codes in the same order as the embeddings.
+    similar_indices (np.ndarray): Neighbour indices, one row per product.
+    similarity_scores (np.ndarray): Neighbour scores, one row per product.
+
+    Returns:
+    dict: Product code to list of (product code, score as string) tuples.
+    """
+    product_codes = np.asarray(product_codes, dtype=object)
+    similarity_dict = {}
+
+    for product_code, indices, scores in zip(
+        product_codes, similar_indices, similarity_scores
+    ):
+        similarity_dict[product_code] = list(
+            zip(product_codes[indices].tolist(), [str(x) for x in scores])
+        )
+
+    return similarity_dict
+
+
+def build_hnsw_index(embeddings, ef_construction=200, m=16, ef_search=400):
+    """
+    Build an HNSW approximate nearest-neighbour index over the embeddings.
+
+    Parameters:
+    embeddings (np.ndarray): The array of embeddings for all products.
+    ef_construction (int): Size of the candidate list used while building the index.
+    m (int): Number of bi-directional links created per element.
+    ef_search (int): Size of the candidate list used at query time.
+
+    Returns:
+    hnswlib.Index: The index, with element labels equal to the embedding row numbers.
+    """
+    embeddings = normalize_embeddings(embeddings)
+
+    index = hnswlib.Index(space="ip", dim=embeddings.shape[1])
+    index.init_index(max_elements=len(embeddings), ef_construction=ef_construction, M=m)
+    index.add_items(embeddings, np.arange(len(embeddings)))
+    index.set_ef(ef_search)
+
+    return index
+
+
+def load_hnsw_index(path, dim, ef_search=400):
+    """
+    Load an HNSW index previously saved with index.save_index.
+
+    Parameters:
+    path (str): Path to the saved index.
+    dim (int): Dimension of the indexed embeddings.
+    ef_search (int): Size of the candidate list used at query time.
+
+    Returns:
+    hnswlib.Index: The loaded index.
+    """
+    index = hnswlib.Index(space="ip", dim=dim)
+    index.load_index(path)
+    index.set_ef(ef_search)
+    return index
+
+
+def hnsw_index_to_bytes(index):
+    """
+    Serialize an HNSW index to the bytes of its saved index file.
+
+    Parameters:
+    index (hnswlib.Index): The index.
+
+    Returns:
+    bytes: The content of the file written by index.save_index.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index")
+        index.save_index(path)
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def hnsw_index_from_bytes(index_bytes, dim=None, ef_search=400):
+    """
+    Load an HNSW index from the bytes returned by hnsw_index_to_bytes.
+
+    Parameters:
+    index_bytes (bytes): The content of a saved index file.
+    dim (int): Dimension of the indexed embeddings. Defaults to the dimension read
+    from the header of the index file.
+    ef_search (int): Size of the candidate list used at query time.
+
+    Returns:
+    hnswlib.Index: The loaded index.
+    """
+    if dim is None:
+        # The header starts with six size_t fields, the last two being the offsets of
+        # the element labels and of the element vectors of float32 components.
+        header = struct.unpack_from("<6Q", index_bytes)
+        dim = (header[4] - header[5]) // np.dtype(np.float32).itemsize
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index")
+        with open(path, "wb") as f:
+            f.write(index_bytes)
+        return load_hnsw_index(path, dim, ef_search=ef_search)
+
+
+def query_hnsw_index(
+    index, embeddings=None, num_similar=200, block_size=1024, query_indices=None
+):
+    """
+    Find the most similar products of each product using an HNSW index.
+
+    Only the queried rows of the embeddings are normalized, one block at a time.
+
+    Parameters:
+    index (hnswlib.Index): Index built over the same embeddings.
+    embeddings (np.ndarray): The array of embeddings for all products. Defaults to
+    the normalized embeddings stored in the index.
+    num_similar (int): The number of similar products to find.
+    block_size (int): The number of products queried at once.
+    query_indices (np.ndarray): Rows to find neighbours for. Defaults to all rows.
+
+    Returns:
+    tuple: Indices of the most similar products and their similarity scores,
+    both of shape (len(query_indices), num_similar). A product is never its own neighbour.
+    """
+    num_products = index.get_current_count()
+
+    if query_indices is None:
+        query_indices = np.arange(num_products)
+    query_indices = np.asarray(query_indices)
+
+    num_similar = min(num_similar, num_products - 1)
+    all_indices = np.empty((len(query_indices), num_similar), dtype=np.int64)
+    all_scores = np.empty((len(query_indices), num_similar), dtype=np.float32)
+
+    for start in tqdm(range(0, len(query_indices), block_size), desc="Querying index"):
+        block = query_indices[start : start + block_size]
+        if embeddings is None:
+            queries = np.asarray(index.get_items(block), dtype=np.float32)
+        else:
+            queries = normalize_embeddings(embeddings[block])
+        labels, distances = index.knn_query(queries, k=num_similar + 1)
+
+        # Drop the product itself, or the weakest neighbour if it was not returned.
+        is_self = labels == block[:, None]
+        is_self[~is_self.any(axis=1), -1] = True
+        keep = ~is_self
+
+        all_indices[start : start + len(block)] = labels[keep].reshape(
+            len(block), num_similar
+        )
+        all_scores[start : start + len(block)] = (1 - distances[keep]).reshape(
+            len(block), num_similar
+        )
+
+    return all_indices, all_scores
+
+
+def find_similar_to_product(index, product_index, num_similar=200):
+    """
+    Find the most similar products of a single product using an HNSW index, from
+    the embedding stored in the index.
+
+    Parameters:
+    index (hnswlib.Index): The index.
+    product_index (int): Row of the given product in the indexed embeddings.
+    num_similar (int): The number of similar products to find.
+
+    Returns:
+    tuple: Indices of the most similar products and their similarity scores.
+    """
+    similar_indices, similarity_scores = query_hnsw_index(
+        index, num_similar=num_similar, query_indices=[product_index]
+    )
+    return similar_indices[0], similarity_scores[0]
+
+
+def recall_at_k(approximate_indices, exact_indices):
+    """
+    Compute the mean recall of approximate neighbours against the exact ones.
+
+    Parameters:
+    approximate_indices (np.ndarray): Approximate neighbour indices, one row per query.
+    exact_indices (np.ndarray): Exact neighbour indices, one row per query.
+
+    Returns:
+    float: Fraction of the exact neighbours retrieved, averaged over queries.
+    """
+    hits = [
+        len(np.intersect1d(approximate, exact)) / len(exact)
+        for approximate, exact in zip(approximate_indices, exact_indices)
+    ]
+    return float(np.mean(hits))
@@ -4,12 +4,15 @@
 import argparse
 import gc
 import os
+import re
 
 import pandas as pd
 import yaml
 from tqdm import tqdm
 from transformers import pipeline
 
+from cache_handlers import ResultCache
+from checkpoint_handlers import CheckpointJournal
 from mongodb_lib import *
 
 # Load MongoDB configuration from YAML file
@@ -19,6 +22,148 @@ db, fs, client = connect_to_mongodb(config_infra)
 # Run garbage collection to free up memory.
 gc.collect()
 
+# Generation parameters of the summaries, part of the summary cache key.
+generation_params = {"max_length": 150, "min_length": 30}
+
+
+def lead_sentences(tokenizer, text, max_length):
+    """
+    Build an extractive summary from the leading sentences of a text.
+
+    Parameters:
+    tokenizer (PreTrainedTokenizer): The tokenizer of the summarization model.
+    text (str): The text to summarize.
+    max_length (int): Maximum length of the summary in tokens.
+
+    Returns:
+    str: The longest run of leading sentences within max_length tokens, or None if
+    the first sentence alone is longer.
+    """
+    sentences = re.split(r"(?<=[.!?])\s+", text.strip())
+    lengths = [
+        len(ids) for ids in tokenizer(sentences, add_special_tokens=False)["input_ids"]
+    ]
+
+    n = 0
+    total = 0
+    while n < len(sentences) and total + lengths[n] <= max_length:
+        total += lengths[n]
+        n += 1
+
+    return " ".join(sentences[:n]) if n else None
+
+
+def summarize_texts(
+    summarizer,
+    texts,
+    batch_size=8,
+    max_length=150,
+    min_length=30,
+    passthrough_length=None,
+    extractive_length=None,
+):
+    """
+    Summarize texts in batches of similar token length.
+
+    Texts are summarized in tiers: empty texts as empty strings, texts of at most
+    passthrough_length tokens as themselves, texts of at most extractive_length tokens
+    as their leading sentences, and only the remaining texts by the model. Texts longer
+    than the model's maximum input length are truncated up front.
+
+    Parameters:
+    summarizer (Pipeline): The summarization pipeline.
+    texts (list): The texts to summarize.
+    batch_size (int): Number of texts summarized per model call.
+    max_length (int): Maximum length of a summary in tokens.
+    min_length (int): Minimum length of a summary in tokens.
+    passthrough_length (int): Maximum length in tokens of texts kept as they are.
+    Defaults to max_length, set to 0 to disable.
+    extractive_length (int): Maximum length in tokens of texts summarized by their
+    leading sentences. Defaults to 0, which disables the extractive tier.
+
+    Yields:
+    tuple: Position of a text in texts and its summary, in batch order.
+    """
+    if passthrough_length is None:
+        passthrough_length = max_length
+    extractive_length = extractive_length or 0
+
+    positions = [i for i, text in enumerate(texts) if text]
+    tiers = {"empty": len(texts) - len(positions)}
+
+    for i in range(len(texts)):
+        if not texts[i]:
+            yield i, ""
+
+    if not positions:
+        print(f"Summarization tiers: {tiers}")
+        return
+
+    tokenizer = summarizer.tokenizer
+    max_input_length = (
+        tokenizer.model_max_length - tokenizer.num_special_tokens_to_add()
+    )
+
+    # Truncate long inputs once, so that batches are bucketed by their real length.
+    input_ids = tokenizer(
+        [texts[i] for i in positions],
+        truncation=True,
+        max_length=max_input_length,
+        add_special_tokens=False,
+    )["input_ids"]
+    lengths = {i: len(ids) for i, ids in zip(positions, input_ids)}
+
+    # Short texts are already within the summary length.
+    passthrough = [i for i in positions if lengths[i] <= passthrough_length]
+    for i in passthrough:
+        yield i, texts[i]
+
+    # Medium texts are summarized by their leading sentences, when these fit.
+    abstractive = [i for i in positions if lengths[i] > passthrough_length]
+    extractive = 0
+    if extractive_length:
+        remaining = []
+        for i in abstractive:
+            summary = (
+                lead_sentences(tokenizer, texts[i], max_length)
+                if lengths[i] <= extractive_length
+                else None
+            )
+            if summary is None:
+                remaining.append(i)
+            else:
+                extractive += 1
+                yield i, summary
+        abstractive = remaining
+
+    tiers.update(
+        passthrough=len(passthrough),
+        extractive=extractive,
+        abstractive=len(abstractive),
+    )
+    print(f"Summarization tiers: {tiers}")
+
+    inputs = {
+        i: tokenizer.decode(ids) if len(ids) == max_input_length else texts[i]
+        for i, ids in zip(positions, input_ids)
+    }
+
+    order = sorted(abstractive, key=lambda i: lengths[i])
+
+    for start in tqdm(range(0, len(order), batch_size), desc="Summarizing"):
+        batch = order[start : start + batch_size]
+        summaries = summarizer(
+            [inputs[i] for i in batch],
+            max_length=max_length,
+            min_length=min_length,
+            do_sample=False,
+            truncation=True,
+            batch_size=len(batch),
+        )
+
+        for i, summary in zip(batch, summaries):
+            yield i, summary["summary_text"]
+
 
 def main():
     """
@@ -26,11 +171,13 @@ def main():
 
     Steps:
     1. Load the product textual data from MongoDB.
-    2. Check for intermediate results to potentially resume from.
-    3. Initialize the summarization pipeline.
-    4. Summarize each product description and save intermediate results.
-    5. Save the final summarized descriptions to MongoDB.
-    6. Clean up any intermediate files.
+    2. Load the checkpoint journal to resume from the products already summarized.
+    3. Look up the remaining descriptions in the summary cache.
+    4. Initialize the summarization pipeline.
+    5. Summarize the cache misses by tier (short descriptions pass through, long ones go to
+       the model in length-bucketed batches), journaling and caching the results.
+    6. Save the final summarized descriptions to MongoDB.
+    7. Clean up the checkpoint journal and report the cache hits and misses.
     """
 
     parser = argparse.ArgumentParser()
@@ -43,79 +190,138 @@ def main():
         required=True,
         help="The summarization model.",
     )
+    parser.add_argument(
+        "--batch_size", type=int, default=8, help="Descriptions summarized per call."
+    )
+    parser.add_argument(
+        "--ignore_cache",
+        action="store_true",
+        help="Re-summarize every description instead of reusing cached summaries.",
+    )
+    parser.add_argument(
+        "--passthrough_length",
+        type=int,
+        default=generation_params["max_length"],
+        help="Descriptions of at most this many tokens are kept as they are.",
+    )
+    parser.add_argument(
+        "--extractive_length",
+        type=int,
+        default=0,
+        help="Descriptions of at most this many tokens are summarized by their "
+        "leading sentences instead of the model (0 disables this tier).",
+    )
 
     args = parser.parse_args()
 
     summarization_model = args.summarization_model
+    summary_params = {
+        **generation_params,
+        "passthrough_length": args.passthrough_length,
+        "extractive_length": args.extractive_length,
+    }
 
     # Specify the name for the processed textual data in English.
     object_name = "product_textual_english_summarized"
-    existing_file = fs.find_one({"filename": object_name})
+    inputs_hash = compute_inputs_hash(
+        fs,
+        upstream_objects=["product_textual_english"],
+        params={
+            "summarization_model": summarization_model,
+            "summary_params": summary_params,
+        },
+        input_files=[
+            __file__,
+            os.path.join(os.path.dirname(__file__), "cache_handlers.py"),
+            os.path.join(os.path.dirname(__file__), "checkpoint_handlers.py"),
+        ],
+    )
 
-    if not existing_file or args.overwrite:
+    if args.overwrite or not is_up_to_date(fs, [object_name], inputs_hash):
 
         # Load the product textual data from MongoDB.
         df = read_object(fs, "product_textual_english")
         df = pd.DataFrame(df)
         df.fillna("", inplace=True)
 
-        # Define the intermediate file path.
-        intermediate_file = "tmp/product_textual_english_summarized_intermediate.pickle"
+        # Resume from the summaries journaled by an interrupted run.
+        journal = CheckpointJournal(
+            "tmp/product_textual_english_summarized_journal.jsonl",
+            version=inputs_hash,
+        )
+        descriptions_summarized = journal.load()
+
+        product_codes = df["PRODUCTCODE"].tolist()
+        descriptions = df["pdt_product_detail_PRODUCTDESCRIPTION_translated"].tolist()
+        pending = [
+            i
+            for i, product_code in enumerate(product_codes)
+            if product_code not in descriptions_summarized
+        ]
 
-        # Check if an intermediate file exists to resume from.
-        if os.path.exists(intermediate_file):
-            df_intermediate = pd.read_pickle(intermediate_file)
-            descriptions_summarized = df_intermediate[
-                "pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED"
-            ].tolist()
-            start_index = len(descriptions_summarized)
-            print(f"Resuming from index {start_index}")
-        else:
-            descriptions_summarized = []
-            start_index = 0
+        # Reuse the summaries of descriptions already summarized with the same settings.
+        cache = ResultCache(db, "summary_cache")
+        cache_keys = {
+            i: ResultCache.key(descriptions[i], summarization_model, summary_params)
+            for i in pending
+        }
+        cached = {} if args.ignore_cache else cache.lookup(list(cache_keys.values()))
 
-        # Initialize the summarization pipeline.
-        summarizer = pipeline("summarization", model=summarization_model)
+        new_summaries = {
+            product_codes[i]: cached[cache_keys[i]]
+            for i in pending
+            if cache_keys[i] in cached
+        }
+        journal.append(new_summaries)
+        descriptions_summarized.update(new_summaries)
+
+        pending = [i for i in pending if cache_keys[i] not in cached]
+
+        # Initialize the summarization pipeline, unless every summary was cached.
+        summarizer = (
+            pipeline("summarization", model=summarization_model) if pending else None
+        )
 
         # Define the interval for saving intermediate results.
         save_interval = 50
 
-        # Loop through each product description, starting from the last saved index.
-        for i, desc in enumerate(
-            tqdm(
-                df["pdt_product_detail_PRODUCTDESCRIPTION_translated"][start_index:],
-                total=len(df) - start_index,
-                desc="Summarizing",
+        new_summaries = {}
+        new_cache_entries = {}
+
+        # Summarize the remaining product descriptions tier by tier.
+        for n, (i, summarized_desc) in enumerate(
+            summarize_texts(
+                summarizer,
+                [descriptions[i] for i in pending],
+                batch_size=args.batch_size,
+                **summary_params,
             )
         ):
-            if desc:
-                summarized_desc = summarizer(
-                    desc, max_length=150, min_length=30, do_sample=False
-                )[0]["summary_text"]
-            else:
-                summarized_desc = ""
-
-            descriptions_summarized.append(summarized_desc)
+            new_summaries[product_codes[pending[i]]] = summarized_desc
+            new_cache_entries[cache_keys[pending[i]]] = summarized_desc
 
-            # Save intermediate results at defined intervals or at the end.
-            if (i + 1) % save_interval == 0 or (start_index + i + 1) == len(df):
-                df_intermediate = df.copy()
-                df_intermediate = df_intermediate.iloc[: start_index + i + 1]
-                df_intermediate[
-                    "pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED"
-                ] = descriptions_summarized
-                df_intermediate.to_pickle(intermediate_file)
-                print(f"Saved intermediate results at iteration {start_index + i + 1}")
+            # Append the new summaries to the journal at defined intervals or at the end.
+            if (n + 1) % save_interval == 0 or (n + 1) == len(pending):
+                journal.append(new_summaries)
+                cache.update(new_cache_entries)
+                descriptions_summarized.update(new_summaries)
+                new_summaries = {}
+                new_cache_entries = {}
 
         # Add the summarized descriptions to the DataFrame and save the final results.
-        df["pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED"] = descriptions_summarized
+        df["pdt_product_detail_PRODUCTDESCRIPTION_SUMMARIZED"] = [
+            descriptions_summarized[product_code] for product_code in product_codes
+        ]
 
         # Save the processed DataFrame to MongoDB.
 
         remove_object(fs=fs, object_name=object_name)
-        save_object(fs=fs, object=df, object_name=object_name)
+        save_object(fs=fs, object=df, object_name=object_name, inputs_hash=inputs_hash)
+        journal.remove()
         print("Saved final results")
 
+        cache.report("Summary")
+
     else:
         print("Skipping summarization.")
 
@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import gc
+import logging
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import torch
+from deep_translator import GoogleTranslator
+from transformers import MarianMTModel, MarianTokenizer
+
+# Run garbage collection to free up memory.
+gc.collect()
+
+
+class GoogleTranslateBackend:
+    def __init__(
+        self,
+        source="auto",
+        target="en",
+        batch_size=50,
+        max_workers=4,
+        max_retries=3,
+        backoff=1.0,
+    ):
+        """
+        Initialize the GoogleTranslateBackend, which translates batches of texts with
+        a bounded number of concurrent requests.
+
+        Any object with name and uses_source_language attributes and a translate_batch
+        method, e.g. a local stub, can be used in its place by the Translator.
+
+        Parameters:
+        source (str): The source language, or "auto" to detect it.
+        target (str): The target language.
+        batch_size (int): The number of texts sent per translator call.
+        max_workers (int): The maximum number of concurrent translator calls.
+        max_retries (int): The number of retries of a failed call.
+        backoff (float): Seconds waited before the first retry, doubled for every next one.
+        """
+        self.source = source
+        self.target = target
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.name = f"google:{source}:{target}"
+        self.uses_source_language = False
+
+    def translate_chunk(self, texts):
+        """
+        Translate a chunk of texts with one translator, retrying failed calls.
+
+        Parameters:
+        texts (list): The texts to translate.
+
+        Returns:
+        list: The translated texts. Texts that cannot be translated are returned unchanged.
+        """
+        translator = GoogleTranslator(source=self.source, target=self.target)
+
+        for attempt in range(self.max_retries + 1):
+            try:
+                return translator.translate_batch(texts)
+            except Exception as e:
+                if attempt < self.max_retries:
+                    time.sleep(self.backoff * 2**attempt)
+                else:
+                    print(f"Translation error: {e}, translating texts one by one.")
+
+        # Isolate the texts that make the whole chunk fail.
+        translations = []
+        for text in texts:
+            try:
+                translations.append(translator.translate(text))
+            except Exception as e:
+                print(f"Translation error: {e} in {text}")
+                translations.append(text)
+        return translations
+
+    def translate_batch(self, texts, languages=None):
+        """
+        Translate texts in concurrent chunks.
+
+        Parameters:
+        texts (list): The texts to translate.
+        languages (list): Ignored, the source language is set at initialization.
+
+        Returns:
+        list: The translated texts, in the same order as texts.
+        """
+        chunks = [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            translated_chunks = list(executor.map(self.translate_chunk, chunks))
+
+        return [
+            translation if translation is not None else text
+            for text, translation in zip(
+                texts, [t for chunk in translated_chunks for t in chunk]
+            )
+        ]
+
+
+class MarianBackend:
+    def __init__(
+        self,
+        model_template="Helsinki-NLP/opus-mt-{source}-en",
+        batch_size=16,
+        max_length=512,
+        fallback=None,
+    ):
+        """
+        Initialize the MarianBackend, which translates batches of texts offline with one
+        local MarianMT model per source language, each loaded once on first use.
+
+        Parameters:
+        model_template (str): Name or local path of the models, formatted with the
+        source language code.
+        batch_size (int): The number of chunks translated per model call.
+        max_length (int): Maximum length of a chunk in tokens, longer texts are split
+        into chunks of whole sentences and translated chunk by chunk.
+        fallback (object): Backend translating the texts of languages without a model,
+        e.g. a GoogleTranslateBackend. Defaults to leaving them untranslated.
+        """
+        self.model_template = model_template
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.fallback = fallback
+        self.name = f"marian:{model_template}"
+        self.uses_source_language = True
+        self.models = {}
+
+    def load_model(self, source):
+        """
+        Load the model of a source language, once.
+
+        Parameters:
+        source (str): The source language code.
+
+        Returns:
+        tuple: The tokenizer and model, or None if there is no model for the language.
+        """
+        if source not in self.models:
+            model_name = self.model_template.format(source=source)
+            try:
+                tokenizer = MarianTokenizer.from_pretrained(model_name)
+                model = MarianMTModel.from_pretrained(model_name).eval()
+                self.models[source] = (tokenizer, model)
+            except Exception as e:
+                logging.warning(f"No translation model for '{source}': {e}")
+                self.models[source] = None
+
+        return self.models[source]
+
+    def split_text(self, tokenizer, text):
+        """
+        Split a text into chunks of whole sentences of at most max_length tokens.
+
+        Sentences longer than max_length tokens on their own are split at token
+        boundaries.
+
+        Parameters:
+        tokenizer (MarianTokenizer): The tokenizer of the model.
+        text (str): The text to split.
+
+        Returns:
+        list: The chunks, in text order.
+        """
+        max_tokens = self.max_length - tokenizer.num_special_tokens_to_add()
+        sentences = re.split(r"(?<=[.!?])\s+", text.strip())
+        sentence_ids = tokenizer(sentences, add_special_tokens=False)["input_ids"]
+
+        chunks = []
+        current = []
+        length = 0
+
+        for sentence, ids in zip(sentences, sentence_ids):
+            if current and (length + len(ids) > max_tokens or len(ids) > max_tokens):
+                chunks.append(" ".join(current))
+                current = []
+                length = 0
+
+            if len(ids) > max_tokens:
+                chunks.extend(
+                    tokenizer.decode(ids[start : start + max_tokens])
+                    for start in range(0, len(ids), max_tokens)
+                )
+            else:
+                current.append(sentence)
+                length += len(ids)
+
+        if current:
+            chunks.append(" ".join(current))
+
+        return chunks
+
+    def translate_batch(self, texts, languages=None):
+        """
+        Translate texts grouped by source language, in batches of chunks of similar
+        length, each text being rejoined from the translations of its chunks.
+
+        Parameters:
+        texts (list): The texts to translate.
+        languages (list): The detected source language of each text.
+
+        Returns:
+        list: The translated texts, in the same order as texts. Texts of undetected
+        languages, and of languages without a model when there is no fallback, are
+        returned unchanged.
+        """
+        translations = list(texts)
+        groups = {}
+        for i, language in enumerate(languages or [""] * len(texts)):
+            # Detectors may return regional codes, e.g. "zh-cn".
+            source = (language or "").split("-")[0]
+            if source:
+                groups.setdefault(source, []).append(i)
+
+        for source, positions in groups.items():
+            loaded = self.load_model(source)
+            if loaded is None:
+                if self.fallback is not None:
+                    fallback_translations = self.fallback.translate_batch(
+                        [texts[i] for i in positions], [source] * len(positions)
+                    )
+                    for i, translation in zip(positions, fallback_translations):
+                        translations[i] = translation
+                continue
+            tokenizer, model = loaded
+
+            # Chunks of all texts, as (position of the text, chunk).
+            chunks = [
+                (i, chunk)
+                for i in positions
+                for chunk in self.split_text(tokenizer, texts[i])
+            ]
+            chunk_translations = [None] * len(chunks)
+
+            order = sorted(range(len(chunks)), key=lambda j: len(chunks[j][1]))
+            for start in range(0, len(order), self.batch_size):
+                batch = order[start : start + self.batch_size]
+                inputs = tokenizer(
+                    [chunks[j][1] for j in batch],
+                    return_tensors="pt",
+                    padding=True,
+                    truncation=True,
+                    max_length=self.max_length,
+                )
+                with torch.inference_mode():
+                    outputs = model.generate(**inputs)
+                for j, translation in zip(
+                    batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)
+                ):
+                    chunk_translations[j] = translation
+
+            translated_chunks = {}
+            for (i, _), translation in zip(chunks, chunk_translations):
+                translated_chunks.setdefault(i, []).append(translation)
+            for i, parts in translated_chunks.items():
+                translations[i] = " ".join(parts)
+
+        return translations
+
+
+class Translator:
+    def __init__(self, backend, cache=None):
+        """
+        Initialize the Translator, which translates each distinct text once.
+
+        Parameters:
+        backend (object): The translation backend, providing name and translate_batch.
+        cache (ResultCache): Persistent cache of translations keyed by source text hash.
+        Defaults to no persistent cache.
+        """
+        self.backend = backend
+        self.cache = cache
+        self.translations = {}
+
+    def translate(self, texts, languages=None):
+        """
+        Translate texts, deduplicated and looked up in the caches first.
+
+        Parameters:
+        texts (list): The texts to translate.
+        languages (list): The detected source language of each text, used by backends
+        that translate each source language with its own model.
+
+        Returns:
+        list: The translations, in the same order as texts. Empty texts stay empty.
+        """
+        if languages is None or not self.backend.uses_source_language:
+            languages = [None] * len(texts)
+        items = list(zip(languages, texts))
+
+        pending = [
+            item
+            for item in dict.fromkeys(items)
+            if item[1] and item not in self.translations
+        ]
+
+        if self.cache is not None and pending:
+            keys = {
+                item: self.cache.key(
+                    item[1],
+                    self.backend.name,
+                    {"source": item[0]} if item[0] is not None else None,
+                )
+                for item in pending
+            }
+            cached = self.cache.lookup(list(keys.values()))
+            for item in pending:
+                if keys[item] in cached:
+                    self.translations[item] = cached[keys[item]]
+            pending = [item for item in pending if keys[item] not in cached]
+
+        if pending:
+            translated = self.backend.translate_batch(
+                [text for _, text in pending], [language for language, _ in pending]
+            )
+            self.translations.update(zip(pending, translated))
+
+            # Texts returned unchanged may be failed translations, so they are not cached.
+            if self.cache is not None:
+                self.cache.update(
+                    {
+                        keys[item]: translation
+                        for item, translation in zip(pending, translated)
+                        if translation != item[1]
+                    }
+                )
+
+        return [self.translations.get(item, item[1]) for item in items]